@@ -3,53 +3,629 @@ Flask REST API using YOLOv8 Pre-trained Model
 No training needed - works out of the box!
 """
 
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, request, jsonify, render_template_string, g, Response, send_from_directory
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
+import atexit
+import hmac
+import json
+import math
 import os
 import sys
+import threading
+import time
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.inference_yolo import YOLOClassifier
+from app.dedup import BatchDuplicates, dhash, project_result
+from app.label_index import LabelIndex
+from app.latency import LatencyEstimator, DeadlineError, size_bucket
+from app.previews import PreviewCache, FORMATS, preview_key, render_preview
+from app.profiling import sample_stacks, collapse_stacks, stage, torch_trace
+from app.uploads import SpooledRequest, PixelBudget, Upload, DecodeBudgetError
 from app.utils import allowed_file
-from app.config import UPLOAD_FOLDER, ALLOWED_EXTENSIONS, MAX_CONTENT_LENGTH
+from app.vector_index import VectorIndex
+from app.config import (
+    UPLOAD_FOLDER, ALLOWED_EXTENSIONS, MAX_CONTENT_LENGTH,
+    LABEL_INDEX_ENABLED, LABEL_INDEX_PATH,
+    OPTIMIZED_LOAD, COMPILE_MODE, INFERENCE_IMGSZ, WARMUP_BATCH_SIZES,
+    MODEL_SIZES, ENABLED_MODELS, INFERENCE_BACKEND, WORKER_ADDRESSES, WORKER_AUTHKEY,
+    ADMIN_TOKEN, PROFILE_DIR, PROFILE_MAX_SECONDS, PROFILE_MIN_INTERVAL_MS, SLOW_REQUEST_MS,
+    PREVIEW_CACHE_BYTES, PREVIEW_DEFAULT_SIZE, PREVIEW_MAX_SIZE,
+    PREDICT_MODE, VOC_MODEL, VOC_ONNX_PATH, VOC_NUM_THREADS,
+    MODEL_ACCURACY_ORDER, LATENCY_DEVIATIONS, MODEL_RELATIVE_COST,
+    VECTOR_INDEX_ENABLED, VECTOR_INDEX_DIR,
+    UPLOAD_SPOOL_BYTES, MAX_IMAGE_PIXELS, MAX_IMAGE_SIDE, DECODE_BUDGET_BYTES,
+    DECODE_WAIT_SECONDS, DEDUP_MAX_DISTANCE,
+)
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+# Uploads above UPLOAD_SPOOL_BYTES are streamed to a temporary file
+SpooledRequest.spool_bytes = UPLOAD_SPOOL_BYTES
+app.request_class = SpooledRequest
+
 # CORS Configuration - Allow frontend to access API
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)  # Allow all origins for local development
 
 # Initialize classifiers (global instances)
 classifiers = {}
 
+# Optional persistent index of past detections
+label_index = None
+
+# Optional per-model indexes of backbone embeddings (for /api/similar),
+# opened on first use
+vector_indexes = {}
+vector_index_lock = threading.Lock()
+
+# Encoded annotated previews, served from /api/preview/<key>
+preview_cache = PreviewCache(PREVIEW_CACHE_BYTES)
+
+# Live per-model latency estimates for deadline_ms requests
+latency_estimator = LatencyEstimator(
+    deviations=LATENCY_DEVIATIONS, relative_cost=MODEL_RELATIVE_COST
+)
+
+# Results of recent client batches (batch_id), to skip near-duplicates
+batch_duplicates = (
+    BatchDuplicates(max_distance=DEDUP_MAX_DISTANCE) if DEDUP_MAX_DISTANCE >= 0 else None
+)
+
+# Decoded pixels held at once across all requests
+pixel_budget = PixelBudget(DECODE_BUDGET_BYTES)
+
+# Only one sampling profile at a time
+profile_lock = threading.Lock()
+
 
 def init_classifier():
     """Initialize YOLOv8 classifiers on app startup"""
-    global classifiers
+    global classifiers, label_index
     print("\n" + "=" * 60)
     print("Initializing YOLOv8 Classifiers")
     print("=" * 60)
 
-    # Load both medium and large models
-    # Options: 'n' (fastest), 's', 'm', 'l', 'x' (most accurate)
-    print("Loading YOLOv8-Medium...")
-    classifiers['medium'] = YOLOClassifier(model_size='m', threshold=0.5)
-    print("✓ YOLOv8-Medium loaded")
+    if INFERENCE_BACKEND in ('worker', 'spawn'):
+        # Models live in dedicated inference processes; this process only
+        # decodes uploads and formats responses
+        from app.inference_worker import connect_workers, start_worker_process
+
+        connect_timeout = 0
+        authkey = WORKER_AUTHKEY
+        if INFERENCE_BACKEND == 'spawn':
+            _, authkey = start_worker_process(WORKER_ADDRESSES[0], ENABLED_MODELS, authkey)
+            connect_timeout = 600  # Worker downloads / loads models first
+
+        print(f"Connecting to inference workers: {WORKER_ADDRESSES}")
+        remote = connect_workers(
+            WORKER_ADDRESSES, connect_timeout=connect_timeout, authkey=authkey
+        )
+        classifiers.update({
+            name: classifier for name, classifier in remote.items() if name in ENABLED_MODELS
+        })
+        print(f"✓ Remote models: {', '.join(classifiers)}")
+    else:
+        load_local_classifiers()
+
+    load_voc_classifier()
 
-    print("Loading YOLOv8-Large...")
-    classifiers['large'] = YOLOClassifier(model_size='l', threshold=0.5)
-    print("✓ YOLOv8-Large loaded")
+    if LABEL_INDEX_ENABLED:
+        label_index = LabelIndex(LABEL_INDEX_PATH)
+        print(f"✓ Label index: {LABEL_INDEX_PATH} ({label_index.stats()['images']} images)")
+
+    if VECTOR_INDEX_ENABLED:
+        for model_name, classifier in classifiers.items():
+            index = vector_index_for(model_name) if classifier.has_embeddings else None
+            if index is not None:
+                print(f"✓ Vector index ({model_name}): {len(index)} vectors")
+        atexit.register(close_vector_indexes)
 
     print("=" * 60)
     print("✓ All YOLOv8 Models Ready!")
     print("=" * 60)
 
 
+def load_local_classifiers():
+    """Load the YOLOv8 models into this process"""
+    from app.autotune import startup_tuning
+    from app.inference_yolo import YOLOClassifier
+
+    # Thread pools must be sized before the first model runs
+    startup_tuning(ENABLED_MODELS)
+
+    load_options = {
+        'optimize': OPTIMIZED_LOAD,
+        'compile_mode': COMPILE_MODE,
+        'imgsz': INFERENCE_IMGSZ,
+        'warmup_batch_sizes': WARMUP_BATCH_SIZES,
+    }
+
+    # Load the models enabled for this instance (default: medium and large)
+    # Options: 'n' (fastest), 's', 'm', 'l', 'x' (most accurate)
+    for name in ENABLED_MODELS:
+        print(f"Loading YOLOv8-{name.capitalize()}...")
+        classifiers[name] = YOLOClassifier(
+            model_size=MODEL_SIZES[name], threshold=0.5, **load_options
+        )
+        print(f"✓ YOLOv8-{name.capitalize()} loaded")
+
+
+def load_voc_classifier():
+    """
+    Load the 100x100 VOC CNN (ONNX Runtime) as model 'voc'
+
+    Always runs in this process: it is cheap enough that shipping images to
+    a worker would cost more than the inference itself.
+    """
+    if VOC_MODEL == '0' or (VOC_MODEL == 'auto' and not os.path.exists(VOC_ONNX_PATH)):
+        return
+
+    from app.inference_voc import VOCClassifier
+
+    print("Loading VOC-CNN-100x100...")
+    classifiers['voc'] = VOCClassifier(
+        model_path=VOC_ONNX_PATH, threshold=0.5, num_threads=VOC_NUM_THREADS
+    )
+    print("✓ VOC-CNN-100x100 loaded")
+
+
+def fallback_model():
+    """Model used for unknown selections: medium, or whatever is loaded"""
+    return 'medium' if 'medium' in classifiers else next(iter(classifiers))
+
+
+def get_inference_options():
+    """
+    Read per-request inference options from the form
+
+    Form fields:
+        - imgsz (optional): Input resolution, e.g. 320, 480, 640, 960
+        - rect (optional): 'true' for a rectangular letterbox
+        - classes (optional): Comma-separated class names to keep
+        - label_set (optional): 'coco' (default) or 'voc' for the 20
+          PASCAL VOC classes
+
+    Returns:
+        Dictionary of keyword arguments for YOLOClassifier.detect()
+    """
+    options = {}
+
+    imgsz = request.form.get('imgsz')
+    if imgsz:
+        try:
+            options['imgsz'] = int(imgsz)
+        except ValueError:
+            raise ValueError('imgsz must be an integer')
+
+    if request.form.get('rect', '').lower() in ('1', 'true', 'yes'):
+        options['rect'] = True
+
+    classes = [
+        name.strip() for name in request.form.get('classes', '').split(',')
+        if name.strip()
+    ]
+    if classes:
+        options['classes'] = classes
+
+    label_set = request.form.get('label_set', '').lower()
+    if label_set and label_set != 'coco':
+        options['label_set'] = label_set
+
+    return options
+
+
+def get_deadline():
+    """
+    Read the optional latency budget from the form
+
+    Form fields:
+        - deadline_ms (optional): Answer within this many milliseconds;
+          the server picks the most accurate model expected to make it
+
+    Returns:
+        Deadline in milliseconds, or None
+    """
+    deadline_ms = request.form.get('deadline_ms')
+    if not deadline_ms:
+        return None
+    try:
+        deadline_ms = float(deadline_ms)
+    except ValueError:
+        raise ValueError('deadline_ms must be a number')
+    if deadline_ms <= 0:
+        raise ValueError('deadline_ms must be positive')
+    return deadline_ms
+
+
+def model_options(classifier, options):
+    """Options as detect() receives them (label-only models always run labels)"""
+    if not classifier.has_boxes:
+        return dict(options, labels_only=True)
+    return options
+
+
+def can_serve(classifier, options, need_boxes=False):
+    """Whether a model can answer a request with these options"""
+    if classifier.has_boxes:
+        return True
+    # Label-only VOC model: only the 20 VOC classes, fixed input size
+    return (not need_boxes and options.get('label_set') == 'voc'
+            and not options.get('imgsz') and not options.get('rect'))
+
+
+def choose_model_for_deadline(upload, options, deadline_ms, need_boxes=False):
+    """
+    Pick the most accurate loaded model expected to answer in time
+
+    Args:
+        upload: Upload from receive_upload() (only its header size is used)
+        options: Per-request options from get_inference_options()
+        deadline_ms: Latency budget
+        need_boxes: Only consider models that return boxes
+
+    Returns:
+        Tuple of (model name, predicted latency in ms or None if the model
+        has no estimate for this kind of request yet)
+
+    Raises:
+        DeadlineError if no model is expected to make the deadline
+    """
+    ranked = [name for name in MODEL_ACCURACY_ORDER if name in classifiers]
+    ranked += [name for name in classifiers if name not in ranked]
+    candidates = [
+        name for name in ranked if can_serve(classifiers[name], options, need_boxes)
+    ]
+    if not candidates:
+        raise ValueError('No loaded model can serve this request')
+
+    buckets = {
+        name: size_bucket(*upload.size, model_options(classifiers[name], options))
+        for name in candidates
+    }
+    model_name, predicted = latency_estimator.choose(candidates, buckets, deadline_ms / 1000)
+    return model_name, round(predicted * 1000, 1) if predicted is not None else None
+
+
+def latency_report(deadline_ms, predicted_ms, start):
+    """Deadline, predicted and actual latency for a deadline_ms response"""
+    return {
+        'deadline_ms': deadline_ms,
+        'predicted_ms': predicted_ms,
+        'actual_ms': round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+def receive_upload(file):
+    """
+    Hash and header-check an uploaded image without decoding it
+
+    The upload is closed (its pixel reservation released) when the request
+    ends.
+
+    Args:
+        file: werkzeug FileStorage from request.files
+
+    Returns:
+        Upload; upload.image() decodes within the pixel budget
+
+    Raises:
+        ValueError for empty, unreadable or oversized images
+    """
+    with stage(g.stage_timings, 'read'):
+        upload = Upload(
+            file.stream, pixel_budget, MAX_IMAGE_PIXELS, MAX_IMAGE_SIDE,
+            wait=DECODE_WAIT_SECONDS
+        )
+    g.uploads.append(upload)
+    return upload
+
+
+def decode_upload(upload):
+    """Decode an upload (timed; waiting for the pixel budget included)"""
+    with stage(g.stage_timings, 'decode'):
+        return upload.image()
+
+
+def decode_budget_error(e):
+    """Response when the decoded-pixel budget stays exhausted"""
+    return jsonify({
+        'success': False,
+        'error': str(e),
+    }), 503
+
+
+def deadline_error(e):
+    """Fail-fast response when no model can make the deadline"""
+    return jsonify({
+        'success': False,
+        'error': str(e),
+        'deadline_ms': e.deadline_ms,
+        'predicted_ms': e.predicted_ms,
+    }), 503
+
+
+def index_key(model_name, options):
+    """
+    Label index cache key: label-only results, results at a non-default
+    resolution, with a class filter or with the VOC projection are stored
+    apart (searches filter on the model name, not this key)
+    """
+    key = model_name
+    if options.get('imgsz') or options.get('rect'):
+        key += f"@{options.get('imgsz', 'default')}"
+        if options.get('rect'):
+            key += 'r'
+    if options.get('label_set'):
+        key += f":{options['label_set']}"
+    if options.get('classes'):
+        key += f"[{','.join(sorted(options['classes']))}]"
+    if options.get('labels_only'):
+        key += '/labels'
+    return key
+
+
+def get_preview_options():
+    """
+    Read annotated-preview options from the form
+
+    Form fields:
+        - preview (optional): 'true' to render a server-side preview
+        - preview_size (optional): Longest preview side (default: 512)
+        - preview_format (optional): 'webp' (default) or 'jpeg'
+
+    Returns:
+        Dictionary with 'max_dim' and 'fmt', or None if not requested
+    """
+    if request.form.get('preview', '').lower() not in ('1', 'true', 'yes'):
+        return None
+
+    try:
+        max_dim = int(request.form.get('preview_size', PREVIEW_DEFAULT_SIZE))
+    except ValueError:
+        raise ValueError('preview_size must be an integer')
+    if not 16 <= max_dim <= PREVIEW_MAX_SIZE:
+        raise ValueError(f'preview_size must be between 16 and {PREVIEW_MAX_SIZE}')
+
+    fmt = request.form.get('preview_format', 'webp').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"preview_format must be one of: {', '.join(FORMATS)}")
+
+    return {'max_dim': max_dim, 'fmt': fmt}
+
+
+def attach_preview(predictions, model_name, classifier, upload,
+                   detected, preview_options, options):
+    """
+    Render (or reuse) the annotated preview and add its URL to a response
+
+    Args:
+        predictions: Response dictionary to add 'preview_url' to
+        model_name: Model whose detections are drawn
+        classifier: Classifier that produced them (for the threshold)
+        upload: Upload the detector ran on (decoded only on a cache miss)
+        detected: detect() output
+        preview_options: Output of get_preview_options()
+        options: Per-request inference options
+    """
+    image_hash = upload.hash
+    key = preview_key(
+        image_hash, model_name, classifier.threshold,
+        preview_options['max_dim'], preview_options['fmt'], options
+    )
+    if preview_cache.get(key) is None:
+        image = decode_upload(upload)
+        with stage(g.stage_timings, f'preview_{model_name}'):
+            data = render_preview(
+                image, detected['detections'],
+                max_dim=preview_options['max_dim'], fmt=preview_options['fmt']
+            )
+        preview_cache.put(key, data, FORMATS[preview_options['fmt']][1])
+
+    # The image hash in the URL lets a router find the instance with the cache
+    predictions['preview_url'] = f'/api/preview/{image_hash}/{key}'
+
+
+def vector_index_for(model_name, dim=None):
+    """
+    Vector index of a model, opened on first use
+
+    Args:
+        model_name: Key of the classifier in `classifiers`
+        dim: Embedding size, to create the index if it doesn't exist yet
+
+    Returns:
+        VectorIndex, or None if it doesn't exist and no dim was given
+    """
+    with vector_index_lock:
+        index = vector_indexes.get(model_name)
+        if index is None:
+            directory = os.path.join(VECTOR_INDEX_DIR, model_name)
+            if dim is None and not os.path.exists(os.path.join(directory, 'meta.json')):
+                return None
+            index = vector_indexes[model_name] = VectorIndex(directory, dim)
+        return index
+
+
+def close_vector_indexes():
+    """Write buffered vectors at exit"""
+    for index in vector_indexes.values():
+        index.close()
+
+
+def needs_embedding(model_name, classifier, image_hash):
+    """Whether an inference should also produce an embedding to index"""
+    if not VECTOR_INDEX_ENABLED or not classifier.has_embeddings:
+        return False
+    index = vector_index_for(model_name)
+    return index is None or image_hash not in index
+
+
+def store_embedding(model_name, image_hash, detected):
+    """Move the embedding out of a detect() output into the vector index"""
+    embedding = detected.pop('embedding', None)
+    if embedding is not None:
+        vector_index_for(model_name, dim=len(embedding)).add(image_hash, embedding)
+
+
+def run_detection(model_name, classifier, upload, need_boxes=False, options=None,
+                  batch_id=None):
+    """
+    Run the detector, answering already-seen images from the label index
+
+    With the vector index enabled, new images also get their backbone
+    embedding indexed, taken from the same forward pass. Index hits that
+    have no embedding yet (indexed before the vector index was enabled, or
+    buffered vectors lost on a restart) get one from a label-only pass.
+
+    Args:
+        model_name: Key of the classifier in `classifiers`
+        classifier: YOLOClassifier instance
+        upload: Upload from receive_upload(); only decoded when the model
+                has to run
+        need_boxes: Whether the caller needs bounding boxes
+        options: Per-request options from get_inference_options()
+        batch_id: Client batch the upload belongs to; a near-duplicate of
+                  an earlier image of the batch is answered from its result
+                  (the output then has 'duplicate_of', that image's hash)
+
+    Returns:
+        Tuple of (detect() output, served-without-inference flag)
+    """
+    options = options or {}
+    timings = g.stage_timings
+    image_hash = upload.hash
+    key = index_key(model_name, options)
+
+    embed = needs_embedding(model_name, classifier, image_hash)
+    detect_options = dict(options, embed=True) if embed else options
+
+    if label_index is not None:
+        with stage(timings, 'index_lookup'):
+            detected = label_index.lookup(
+                image_hash, key, classifier.threshold, need_boxes=need_boxes
+            )
+        if detected is not None:
+            if embed:
+                # Backfill the embedding with the cheapest backbone pass
+                image = decode_upload(upload)
+                with stage(timings, f'embedding_{model_name}'):
+                    store_embedding(model_name, image_hash, timed_detect(
+                        model_name, classifier, image, {'labels_only': True, 'embed': True}
+                    ))
+            record_request_details(model_name, detected, True)
+            return detected, True
+
+    image = decode_upload(upload)
+
+    if batch_id and batch_duplicates is not None:
+        # Results differ per model, options and threshold
+        batch_key = (key, classifier.threshold)
+        with stage(timings, 'dedup'):
+            value, size = dhash(image)
+            duplicate = batch_duplicates.find(batch_id, batch_key, value, size)
+        if duplicate is not None:
+            duplicate_of, original = duplicate
+            detected = dict(project_result(original, *size), duplicate_of=duplicate_of)
+            record_request_details(model_name, detected, True)
+            return detected, True
+
+    with stage(timings, f'inference_{model_name}'):
+        detected = timed_detect(model_name, classifier, image, detect_options)
+    store_embedding(model_name, image_hash, detected)
+    if label_index is not None:
+        # Label-only results keep every score so a cached reply matches
+        scores = detected['scores'] if detected['detections'] is None else None
+        label_index.add(image_hash, key, classifier.threshold, detected,
+                        scores=scores, base_model=model_name)
+    if batch_id and batch_duplicates is not None:
+        batch_duplicates.add(batch_id, batch_key, value, size, image_hash, detected)
+    record_request_details(model_name, detected, False)
+    return detected, False
+
+
+def timed_detect(model_name, classifier, source, options):
+    """Run classifier.detect(), feeding the latency estimator"""
+    with latency_estimator.track(model_name):
+        start = time.perf_counter()
+        detected = classifier.detect(source, **options)
+        elapsed = time.perf_counter() - start
+
+    bucket = size_bucket(detected['width'], detected['height'], options)
+    latency_estimator.observe(model_name, bucket, elapsed)
+    return detected
+
+
+def record_request_details(model_name, detected, cached):
+    """Remember what a request ran, for the slow-request log"""
+    g.request_details.append({
+        'model': model_name,
+        'width': detected['width'],
+        'height': detected['height'],
+        'num_detected': len(detected['detections'] or []),
+        'cached': cached,
+    })
+
+
+@app.before_request
+def start_request_timer():
+    """Start per-request stage timing"""
+    g.request_start = time.perf_counter()
+    g.stage_timings = {}
+    g.request_details = []
+    g.uploads = []
+
+
+@app.teardown_request
+def close_uploads(exc):
+    """Release the decoded pixels and spooled files of the request's uploads"""
+    for upload in g.pop('uploads', []):
+        upload.close()
+
+
+@app.after_request
+def log_slow_request(response):
+    """Log requests slower than SLOW_REQUEST_MS with their stage timings"""
+    if SLOW_REQUEST_MS and 'request_start' in g:
+        total_ms = (time.perf_counter() - g.request_start) * 1000
+        if total_ms >= SLOW_REQUEST_MS:
+            app.logger.warning('Slow request: %s', json.dumps({
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': round(total_ms, 1),
+                'stages_ms': {name: round(ms, 1) for name, ms in g.stage_timings.items()},
+                'models': g.request_details,
+            }))
+    return response
+
+
+def check_admin():
+    """
+    Guard for admin endpoints
+
+    Returns:
+        Error response tuple, or None if the request carries ADMIN_TOKEN
+        in the X-Admin-Token header
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({
+            'success': False,
+            'error': 'Admin endpoints disabled (set ADMIN_TOKEN)'
+        }), 404
+
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({
+            'success': False,
+            'error': 'Forbidden'
+        }), 403
+
+    return None
+
+
 # HTML template (same as before, works perfectly with YOLO)
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -370,7 +946,12 @@ def model_info():
         'models': {
             model_name: classifier.get_model_info()
             for model_name, classifier in classifiers.items()
-        }
+        },
+        'latency': latency_estimator.stats(),
+        'vector_index': {
+            model_name: index.stats() for model_name, index in vector_indexes.items()
+        },
+        'decode_budget': pixel_budget.stats()
     }
     return jsonify(info)
 
@@ -383,7 +964,18 @@ def predict():
     Expects:
         - file or image: Image file (multipart/form-data)
         - threshold (optional): Confidence threshold (0.0 to 1.0)
-        - model (optional): 'medium' or 'large' (default: 'medium')
+        - model (optional): 'medium', 'large' or 'voc' (default: 'medium')
+        - imgsz (optional): Input resolution, e.g. 320, 480, 640, 960
+        - rect (optional): 'true' to pad only to the stride multiple
+        - mode (optional): 'labels' for the label-only fast path (no box
+          regression or NMS) or 'detect' (default: PREDICT_MODE)
+        - deadline_ms (optional): Latency budget; the server picks the most
+          accurate model expected to make it (overrides 'model') and
+          answers 503 at once if none is. The response then includes
+          'latency' with the predicted and actual milliseconds
+        - batch_id (optional): Shared by the requests of a client batch; a
+          near-duplicate of an earlier image of the batch is answered from
+          its result, reported as 'duplicate_of' (that image's hash)
 
     Returns:
         JSON with prediction results
@@ -420,12 +1012,32 @@ def predict():
         }), 400
 
     try:
-        # Get model selection (default to medium)
-        model_selection = request.form.get('model', 'medium').lower()
-        if model_selection not in classifiers:
-            model_selection = 'medium'  # Fallback
+        # Hash and check the header; pixels are decoded only if a model runs
+        upload = receive_upload(file)
+
+        options = get_inference_options()
+        mode = request.form.get('mode', PREDICT_MODE).lower()
+        if mode not in ('labels', 'detect'):
+            raise ValueError("mode must be 'labels' or 'detect'")
+        if mode == 'labels':
+            options['labels_only'] = True
+
+        # With a deadline the server picks the model, otherwise the client
+        # does (default to medium)
+        deadline_ms = get_deadline()
+        if deadline_ms:
+            model_selection, predicted_ms = choose_model_for_deadline(
+                upload, options, deadline_ms
+            )
+        else:
+            model_selection = request.form.get('model', 'medium').lower()
+            if model_selection not in classifiers:
+                model_selection = fallback_model()
 
         classifier = classifiers[model_selection]
+        if not classifier.has_boxes:
+            mode = 'labels'  # Classifier-only models (voc) have no detect mode
+            options = model_options(classifier, options)
 
         # Get custom threshold if provided
         threshold = request.form.get('threshold', None)
@@ -433,17 +1045,39 @@ def predict():
             threshold = float(threshold)
             classifier.set_threshold(threshold)
 
-        # Read image data
-        image_data = file.read()
-
         # Make prediction
-        predictions = classifier.predict(image_data)
-
-        return jsonify({
+        start = time.perf_counter()
+        detected, cached = run_detection(
+            model_selection, classifier, upload, options=options,
+            batch_id=request.form.get('batch_id')
+        )
+        predictions = classifier.format_predictions(detected)
+
+        response = {
             'success': True,
             'model': model_selection,
+            'mode': mode,
+            'cached': cached,
             'predictions': predictions
-        })
+        }
+        if 'duplicate_of' in detected:
+            response['duplicate_of'] = detected['duplicate_of']
+        if deadline_ms:
+            response['latency'] = latency_report(deadline_ms, predicted_ms, start)
+        return jsonify(response)
+
+    except DeadlineError as e:
+        return deadline_error(e)
+
+    except DecodeBudgetError as e:
+        return decode_budget_error(e)
+
+    except ValueError as e:
+        # Bad threshold / imgsz values
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
 
     except Exception as e:
         return jsonify({
@@ -459,6 +1093,12 @@ def predict_with_boxes():
 
     Returns predictions plus bounding box coordinates
     Accepts 'model' parameter: 'medium', 'large', or 'both'
+    Accepts 'imgsz' and 'rect' like /api/predict; boxes are always in
+    the original image's pixel space
+    Accepts 'preview' (plus 'preview_size', 'preview_format') to also
+    render a downscaled annotated preview, returned as 'preview_url'
+    Accepts 'deadline_ms' (single model only) and 'batch_id' like
+    /api/predict
     """
     if not classifiers:
         return jsonify({
@@ -493,36 +1133,270 @@ def predict_with_boxes():
         # Get model selection (default to medium)
         model_selection = request.form.get('model', 'medium').lower()
         threshold = request.form.get('threshold', None)
+        options = get_inference_options()
+        preview_options = get_preview_options()
+        batch_id = request.form.get('batch_id')
+
+        # Decoded at most once, shared between the models and the preview
+        upload = receive_upload(file)
 
-        image_data = file.read()
+        deadline_ms = get_deadline()
+        if deadline_ms and model_selection == 'both':
+            raise ValueError("deadline_ms picks a single model; it can't be combined with model=both")
 
         # Handle different model selections
         if model_selection == 'both':
             # Run both models and return comparison
             results = {}
             for model_name, classifier in classifiers.items():
+                if not classifier.has_boxes:
+                    continue
                 if threshold:
                     classifier.set_threshold(float(threshold))
-                results[model_name] = classifier.predict_with_boxes(image_data)
+                detected, cached = run_detection(
+                    model_name, classifier, upload, need_boxes=True, options=options,
+                    batch_id=batch_id
+                )
+                results[model_name] = classifier.format_boxes(detected)
+                results[model_name]['cached'] = cached
+                if 'duplicate_of' in detected:
+                    results[model_name]['duplicate_of'] = detected['duplicate_of']
+                if preview_options:
+                    attach_preview(
+                        results[model_name], model_name, classifier, upload,
+                        detected, preview_options, options
+                    )
 
             return jsonify({
                 'mode': 'comparison',
                 'results': results
             })
         else:
-            # Run single model
-            if model_selection not in classifiers:
-                model_selection = 'medium'  # Fallback to medium
+            # Run single model; with a deadline the server picks it
+            if deadline_ms:
+                model_selection, predicted_ms = choose_model_for_deadline(
+                    upload, options, deadline_ms, need_boxes=True
+                )
+            elif model_selection not in classifiers:
+                model_selection = fallback_model()
 
             classifier = classifiers[model_selection]
+            if not classifier.has_boxes:
+                raise ValueError(f"Model '{model_selection}' returns labels only; use /api/predict")
             if threshold:
                 classifier.set_threshold(float(threshold))
 
-            predictions = classifier.predict_with_boxes(image_data)
+            start = time.perf_counter()
+            detected, cached = run_detection(
+                model_selection, classifier, upload, need_boxes=True, options=options,
+                batch_id=batch_id
+            )
+            predictions = classifier.format_boxes(detected)
             predictions['model'] = model_selection
+            predictions['cached'] = cached
+            if 'duplicate_of' in detected:
+                predictions['duplicate_of'] = detected['duplicate_of']
+            if deadline_ms:
+                predictions['latency'] = latency_report(deadline_ms, predicted_ms, start)
+            if preview_options:
+                attach_preview(
+                    predictions, model_selection, classifier, upload,
+                    detected, preview_options, options
+                )
 
             return jsonify(predictions)
 
+    except DeadlineError as e:
+        return deadline_error(e)
+
+    except DecodeBudgetError as e:
+        return decode_budget_error(e)
+
+    except ValueError as e:
+        # Bad threshold / imgsz values
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """
+    Query past detections by label
+
+    Expects (query string):
+        - labels: Comma-separated class names, all must be present
+        - min_conf (optional): Minimum confidence per label (default: 0.5)
+        - model (optional): Only results from this model
+        - limit (optional): Maximum number of images (default: 100)
+
+    Returns:
+        JSON with matching image hashes and their label scores
+    """
+    if label_index is None:
+        return jsonify({
+            'success': False,
+            'error': 'Label index not enabled (set LABEL_INDEX_ENABLED=1)'
+        }), 404
+
+    labels = [
+        label.strip() for label in request.args.get('labels', '').split(',')
+        if label.strip()
+    ]
+    if not labels:
+        return jsonify({
+            'success': False,
+            'error': 'No labels provided'
+        }), 400
+
+    try:
+        min_conf = float(request.args.get('min_conf', 0.5))
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'min_conf and limit must be numbers'
+        }), 400
+
+    start = time.time()
+    matches = label_index.search(
+        labels, min_conf=min_conf, model=request.args.get('model'), limit=limit
+    )
+
+    return jsonify({
+        'success': True,
+        'labels': labels,
+        'min_conf': min_conf,
+        'num_results': len(matches),
+        'results': matches,
+        'query_time': time.time() - start
+    })
+
+
+@app.route('/api/similar', methods=['GET', 'POST'])
+def similar():
+    """
+    Find visually similar past uploads by backbone embedding
+
+    Expects one of:
+        - POST file or image: Query image (multipart/form-data)
+        - GET image_hash: Content hash of an already indexed image
+        - POST JSON {"vector": [...], "exclude": image_hash}: Query
+          embedding (the router sends this to the other instances)
+    and optionally:
+        - model: Whose embeddings to compare (default: 'medium')
+        - k: Number of results (default: 10)
+        - return_vector: 'true' to include the query embedding
+
+    Returns:
+        JSON with the most similar image hashes and their cosine similarity
+    """
+    if not VECTOR_INDEX_ENABLED:
+        return jsonify({
+            'success': False,
+            'error': 'Vector index not enabled (set VECTOR_INDEX_ENABLED=1)'
+        }), 404
+
+    if not classifiers:
+        return jsonify({
+            'success': False,
+            'error': 'Classifiers not initialized'
+        }), 500
+
+    try:
+        k = int(request.values.get('k', 10))
+        if not 1 <= k <= 1000:
+            raise ValueError('k must be between 1 and 1000')
+
+        model_selection = request.values.get('model', 'medium').lower()
+        if model_selection not in classifiers:
+            model_selection = fallback_model()
+        classifier = classifiers[model_selection]
+        if not classifier.has_embeddings:
+            raise ValueError(f"Model '{model_selection}' does not produce embeddings")
+
+        index = None
+        if request.method == 'POST' and request.is_json:
+            payload = request.get_json()
+            vector = payload.get('vector')
+            if not isinstance(vector, list) or not vector:
+                raise ValueError('vector must be a non-empty list of numbers')
+            vector = [float(value) for value in vector]
+            image_hash = payload.get('exclude')
+            index = vector_index_for(model_selection)
+            if index is not None and len(vector) != index.dim:
+                raise ValueError(f"vector must have {index.dim} dimensions for '{model_selection}'")
+        elif request.method == 'POST':
+            file = request.files.get('file') or request.files.get('image')
+            if file is None:
+                raise ValueError('No file provided')
+
+            upload = receive_upload(file)
+            image_hash = upload.hash
+
+            index = vector_index_for(model_selection)
+            vector = index.get(image_hash) if index is not None else None
+            if vector is None:
+                # Label-only pass: the cheapest forward that runs the backbone
+                image = decode_upload(upload)
+                with stage(g.stage_timings, f'inference_{model_selection}'):
+                    detected = timed_detect(
+                        model_selection, classifier, image,
+                        {'labels_only': True, 'embed': True}
+                    )
+                vector = detected['embedding']
+                store_embedding(model_selection, image_hash, detected)
+        else:
+            image_hash = request.args.get('image_hash', '').lower()
+            if not image_hash:
+                raise ValueError('Provide an image (POST) or an image_hash')
+            index = vector_index_for(model_selection)
+            vector = index.get(image_hash) if index is not None else None
+            if vector is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Image not in the vector index'
+                }), 404
+
+        start = time.time()
+        index = index or vector_index_for(model_selection)
+        matches = []
+        if index is not None:
+            with stage(g.stage_timings, 'vector_search'):
+                matches = index.search(vector, k=k, exclude=image_hash)
+
+        response = {
+            'success': True,
+            'model': model_selection,
+            'image_hash': image_hash,
+            'num_results': len(matches),
+            'results': [
+                {'image_hash': match_hash, 'similarity': round(similarity, 4)}
+                for match_hash, similarity in matches
+            ],
+            'query_time': time.time() - start
+        }
+        if request.args.get('return_vector', 'false').lower() == 'true':
+            response['vector'] = [float(value) for value in vector]
+        return jsonify(response)
+
+    except DecodeBudgetError as e:
+        return decode_budget_error(e)
+
+    except ValueError as e:
+        # Bad k / hash values
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
     except Exception as e:
         return jsonify({
             'success': False,
@@ -530,6 +1404,119 @@ def predict_with_boxes():
         }), 500
 
 
+@app.route('/api/preview/<image_hash>/<key>', methods=['GET'])
+def preview(image_hash, key):
+    """Serve an annotated preview rendered by /api/predict_with_boxes"""
+    entry = preview_cache.get(key)
+    if entry is None:
+        return jsonify({
+            'success': False,
+            'error': 'Preview not found (expired from cache)'
+        }), 404
+
+    data, mimetype = entry
+    # Keys are derived from the image hash and parameters, so never change
+    return Response(data, mimetype=mimetype, headers={
+        'Cache-Control': 'public, max-age=86400, immutable'
+    })
+
+
+@app.route('/api/admin/profile', methods=['GET'])
+def admin_profile():
+    """
+    Sample every thread of the running server for a while
+
+    Expects (query string):
+        - seconds (optional): How long to sample (default: 10, at most
+          PROFILE_MAX_SECONDS)
+        - interval_ms (optional): Sampling interval (default: 5, at least
+          PROFILE_MIN_INTERVAL_MS)
+
+    Returns:
+        Collapsed stacks (flamegraph.pl / speedscope input) as a download
+    """
+    error = check_admin()
+    if error:
+        return error
+
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval_ms = float(request.args.get('interval_ms', 5))
+        if not seconds > 0 or math.isnan(interval_ms):
+            raise ValueError
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'seconds must be a positive number and interval_ms a number'
+        }), 400
+
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    interval = max(interval_ms, PROFILE_MIN_INTERVAL_MS) / 1000
+
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({
+            'success': False,
+            'error': 'A profile is already running'
+        }), 409
+
+    try:
+        counts = sample_stacks(seconds, interval)
+    finally:
+        profile_lock.release()
+
+    filename = f"profile_{int(time.time())}.collapsed"
+    return Response(
+        collapse_stacks(counts),
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+@app.route('/api/admin/torch_trace', methods=['GET', 'POST'])
+def admin_torch_trace():
+    """
+    Record a torch.profiler trace of the next K model calls
+
+    POST with 'calls' (default: 1) arms the recorder; GET returns how many
+    calls are left and the traces written so far. Traces are recorded in
+    the process that runs the models (local backend only).
+    """
+    error = check_admin()
+    if error:
+        return error
+
+    if request.method == 'POST':
+        if INFERENCE_BACKEND != 'local':
+            return jsonify({
+                'success': False,
+                'error': 'Models run in worker processes; trace them there'
+            }), 409
+        try:
+            calls = int(request.values.get('calls', 1))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'calls must be an integer'
+            }), 400
+        torch_trace.arm(calls)
+
+    status = torch_trace.status()
+    return jsonify({
+        'success': True,
+        'remaining': status['remaining'],
+        'traces': [os.path.basename(path) for path in status['traces']]
+    })
+
+
+@app.route('/api/admin/torch_trace/<path:filename>', methods=['GET'])
+def admin_torch_trace_file(filename):
+    """Download a recorded torch trace (open in chrome://tracing or Perfetto)"""
+    error = check_admin()
+    if error:
+        return error
+    return send_from_directory(PROFILE_DIR, secure_filename(filename), as_attachment=True)
+
+
 if __name__ == '__main__':
     import os
 
@@ -551,6 +1538,9 @@ if __name__ == '__main__':
     print("  - GET  /api/info            : Model information")
     print("  - POST /api/predict         : Predict from uploaded file")
     print("  - POST /api/predict_with_boxes : Predict with bounding boxes")
+    print("  - GET  /api/search          : Query past detections by label")
+    print("  - POST /api/similar         : Find visually similar past uploads")
+    print("  - GET  /api/preview/<hash>/<key> : Annotated preview image")
     print("=" * 60)
     print("\n✨ Using YOLOv8 - Pre-trained on COCO (80 classes)")
     print("✨ No training needed - works out of the box!")
@@ -0,0 +1,265 @@
+"""
+Router in front of several copies of the Flask API
+
+Sends each prediction to an instance that has the requested model loaded,
+keeps repeat uploads of the same image on the same instance (consistent
+hashing on the image content hash) and balances by requests in flight.
+
+Example with three local instances:
+    PORT=5001 ENABLED_MODELS=medium python api/flask_app_yolo.py
+    PORT=5002 ENABLED_MODELS=medium python api/flask_app_yolo.py
+    PORT=5003 ENABLED_MODELS=large python api/flask_app_yolo.py
+    ROUTER_BACKENDS=http://127.0.0.1:5001,http://127.0.0.1:5002,http://127.0.0.1:5003 \\
+        python api/router_app.py
+"""
+
+from flask import Flask, request, jsonify, Response
+from flask_cors import CORS
+import json
+import os
+import sys
+import urllib.parse
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.label_index import hash_image
+from app.router import Router
+from app.config import (
+    MAX_CONTENT_LENGTH, MODEL_SIZES, ROUTER_BACKENDS, ROUTER_VIRTUAL_NODES,
+    ROUTER_MAX_IMBALANCE, ROUTER_HEALTH_INTERVAL, ROUTER_TIMEOUT,
+)
+
+# Initialize Flask app
+app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+
+CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
+
+router = Router(
+    ROUTER_BACKENDS,
+    virtual_nodes=ROUTER_VIRTUAL_NODES,
+    max_imbalance=ROUTER_MAX_IMBALANCE,
+    health_interval=ROUTER_HEALTH_INTERVAL,
+    timeout=ROUTER_TIMEOUT,
+)
+
+# Started with the app so it also runs under a WSGI server
+router.start_health_checks()
+
+
+def relay(result):
+    """Turn a Router.route() result into a Flask response"""
+    if result is None:
+        return jsonify({
+            'success': False,
+            'error': 'No healthy backend serves the requested model'
+        }), 503
+
+    status, data, content_type, backend_url = result
+    response = Response(data, status=status, content_type=content_type)
+    response.headers['X-Backend'] = backend_url
+    return response
+
+
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """Router health plus the state of every backend"""
+    backends = [backend.status() for backend in router.backends]
+    models = sorted({model for backend in router.backends if backend.healthy for model in backend.models})
+    return jsonify({
+        'status': 'healthy' if models else 'degraded',
+        'models_loaded': bool(models),
+        'model_type': 'YOLOv8',
+        'available_models': models,
+        'backends': backends,
+    })
+
+
+@app.route('/api/predict', methods=['POST'])
+@app.route('/api/predict_with_boxes', methods=['POST'])
+def route_prediction():
+    """
+    Forward a prediction to the backend chosen for its model and image
+
+    The raw multipart body is forwarded unchanged.
+    """
+    # Cache the raw body first so it can be forwarded after form parsing
+    body = request.get_data()
+
+    upload = request.files.get('file') or request.files.get('image')
+    if upload is None:
+        return jsonify({
+            'success': False,
+            'error': 'No file provided'
+        }), 400
+
+    model = request.form.get('model', 'medium').lower()
+    if request.form.get('deadline_ms'):
+        models = []  # The backend picks the model against the deadline
+    elif model == 'both':
+        models = list(MODEL_SIZES)
+    elif model in MODEL_SIZES or model == 'voc':
+        models = [model]
+    else:
+        models = ['medium']  # Same fallback as the API
+
+    key = hash_image(upload.read())
+    return relay(router.route(
+        key, models, 'POST', request.path, body,
+        headers={'Content-Type': request.content_type}
+    ))
+
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """
+    Each backend has its own label index: query all of them and merge
+
+    Every backend returns its newest matches; the merged list is the newest
+    `limit` overall, with images indexed on several instances listed once.
+    """
+    limit = request.args.get('limit', 100, type=int)
+    merged = {}
+    query_time = 0.0
+
+    for backend_url, status, data in router.broadcast(request.full_path):
+        if status != 200:
+            continue
+        response = json.loads(data)
+        query_time = max(query_time, response.get('query_time', 0.0))
+        for match in response.get('results', []):
+            key = (match['image_hash'], match['model'])
+            current = merged.get(key)
+            if current is None or match.get('created', 0.0) > current.get('created', 0.0):
+                merged[key] = dict(match, backend=backend_url)
+
+    results = sorted(merged.values(), key=lambda match: match.get('created', 0.0), reverse=True)
+    return jsonify({
+        'success': True,
+        'labels': [label for label in request.args.get('labels', '').split(',') if label],
+        'num_results': len(results[:limit]),
+        'results': results[:limit],
+        'query_time': query_time
+    })
+
+
+@app.route('/api/similar', methods=['GET', 'POST'])
+def similar():
+    """
+    Each backend has its own vector index: search all of them and merge
+
+    Only backends serving the model are asked (each model has its own
+    embedding space). The query image goes to one backend, the same one
+    /api/predict would use, which embeds it and returns the vector. The
+    other backends are searched with that vector, so the image is neither
+    re-run nor indexed everywhere.
+    """
+    model = request.values.get('model', 'medium').lower()
+    if model not in MODEL_SIZES:
+        model = 'medium'  # Same fallback as the API
+    k = request.values.get('k', 10, type=int)
+    query = {'model': model, 'k': k}
+
+    if request.method == 'POST':
+        # Cache the raw body first so it can be forwarded after form parsing
+        body = request.get_data()
+        upload = request.files.get('file') or request.files.get('image')
+        if upload is None:
+            return jsonify({
+                'success': False,
+                'error': 'No file provided'
+            }), 400
+
+        first = router.route(
+            hash_image(upload.read()), [model], 'POST',
+            '/api/similar?' + urllib.parse.urlencode(dict(query, return_vector='true')),
+            body, headers={'Content-Type': request.content_type}
+        )
+    else:
+        image_hash = request.args.get('image_hash', '').lower()
+        if not image_hash:
+            return jsonify({
+                'success': False,
+                'error': 'Provide an image (POST) or an image_hash'
+            }), 400
+
+        # The vector lives on the instance that indexed the image
+        first = router.route(
+            image_hash, [model], 'GET',
+            '/api/similar?' + urllib.parse.urlencode(
+                dict(query, image_hash=image_hash, return_vector='true')
+            ),
+            retry_statuses=(404,)
+        )
+
+    if first is None or first[0] != 200:
+        return relay(first)
+
+    status, data, _, first_backend = first
+    response = json.loads(data)
+    query_time = response.get('query_time', 0.0)
+    responses = [(first_backend, response)]
+
+    # Search the other instances with the embedding
+    vector_query = json.dumps({
+        'vector': response['vector'], 'exclude': response['image_hash']
+    }).encode()
+    for backend_url, status, data in router.broadcast(
+        '/api/similar?' + urllib.parse.urlencode(query), 'POST', vector_query,
+        headers={'Content-Type': 'application/json'}, models=[model], skip={first_backend}
+    ):
+        if status == 200:
+            responses.append((backend_url, json.loads(data)))
+
+    # The same image can be indexed on several instances: keep its best match
+    merged = {}
+    for backend_url, response in responses:
+        query_time = max(query_time, response.get('query_time', 0.0))
+        for match in response.get('results', []):
+            current = merged.get(match['image_hash'])
+            if current is None or match['similarity'] > current['similarity']:
+                merged[match['image_hash']] = dict(match, backend=backend_url)
+
+    results = sorted(merged.values(), key=lambda match: match['similarity'], reverse=True)[:k]
+    return jsonify({
+        'success': True,
+        'model': model,
+        'image_hash': responses[0][1]['image_hash'],
+        'num_results': len(results),
+        'results': results,
+        'query_time': query_time
+    })
+
+
+@app.route('/api/preview/<image_hash>/<key>', methods=['GET'])
+def route_preview(image_hash, key):
+    """Previews live in the cache of the instance that rendered them"""
+    return relay(router.route(
+        image_hash, [], 'GET', request.path, retry_statuses=(404,)
+    ))
+
+
+@app.route('/api/<path:path>', methods=['GET'])
+def route_get(path):
+    """Forward other GET endpoints (e.g. /api/info) to a healthy backend"""
+    full_path = request.full_path.rstrip('?')
+    return relay(router.route(request.path, [], 'GET', full_path))
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('ROUTER_PORT', 8000))
+
+    print("=" * 60)
+    print("ObjectVision API Router")
+    print("=" * 60)
+    print(f"Backends: {', '.join(backend.url for backend in router.backends)}")
+
+    for backend in router.backends:
+        state = 'healthy' if backend.healthy else f'down ({backend.last_error})'
+        print(f"  - {backend.url}: {state} {sorted(backend.models)}")
+
+    print(f"\nRouter listening on http://0.0.0.0:{port}")
+    print("=" * 60)
+
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
@@ -0,0 +1,374 @@
+"""
+Autotuner for torch threads and batch size
+
+Benchmarks the YOLOv8 models a host serves on synthetic images for every
+combination of intra-op threads, inter-op threads and batch size, keeps
+the configuration with the best throughput whose batch latency stays
+under a ceiling, and stores it in models/autotune/ under a host
+fingerprint (CPU model, usable cores, torch version, served models and
+load mode). Later startups on the same kind of host apply it without
+re-running (AUTOTUNE=apply, the default).
+
+The models share one torch thread pool, so a configuration is scored by
+the geometric mean of their throughputs: a box running medium and large
+together gets tuned for both.
+
+torch only lets the inter-op pool size be set once per process, so each
+inter-op setting is measured in a child process.
+
+Usage:
+    python app/autotune.py --models medium,large
+    python app/autotune.py --latency-ms 300 --force
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import (
+    AUTOTUNE, AUTOTUNE_DIR, AUTOTUNE_LATENCY_MS, ENABLED_MODELS, MODEL_SIZES,
+    OPTIMIZED_LOAD, COMPILE_MODE, INFERENCE_IMGSZ,
+)
+
+BATCH_SIZES = (1, 2, 4, 8)
+REPEATS = 3
+
+
+def cpu_model():
+    """CPU model name"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def usable_cores():
+    """Cores this process may run on (respects CPU affinity / cgroup pinning)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def host_fingerprint(models):
+    """
+    Identify hosts (and deployments) that share a tuning
+
+    Args:
+        models: Names of the models served together
+
+    Returns:
+        Tuple of (short hex fingerprint, dictionary it was derived from)
+    """
+    import torch
+
+    host = {
+        'cpu': cpu_model(),
+        'cores': usable_cores(),
+        'torch': torch.__version__,
+        'models': sorted(models),
+        'imgsz': INFERENCE_IMGSZ,
+        'optimized': OPTIMIZED_LOAD,
+        'compile_mode': COMPILE_MODE,
+    }
+    digest = hashlib.sha1(json.dumps(host, sort_keys=True).encode()).hexdigest()[:16]
+    return digest, host
+
+
+def thread_options(cores):
+    """Powers of two up to the core count, plus the core count itself"""
+    options = {cores}
+    threads = 1
+    while threads < cores:
+        options.add(threads)
+        threads *= 2
+    return sorted(options)
+
+
+def measure(models, intra_threads, batch_sizes, latency_ms, repeats=REPEATS):
+    """
+    Benchmark loaded models in this process (inter-op threads already set)
+
+    Args:
+        models: Dict of model name -> YOLOClassifier
+        intra_threads: Intra-op thread counts to try
+        batch_sizes: Batch sizes to try (ascending)
+        latency_ms: Larger batches are skipped once one exceeds this
+        repeats: Timed runs per configuration (the median is kept)
+
+    Returns:
+        List of result dictionaries
+    """
+    import torch
+
+    rng = np.random.default_rng(0)
+    rows = []
+
+    for threads in intra_threads:
+        torch.set_num_threads(threads)
+        for name, classifier in models.items():
+            for batch_size in batch_sizes:
+                images = [
+                    rng.integers(0, 255, (classifier.imgsz, classifier.imgsz, 3), dtype=np.uint8)
+                    for _ in range(batch_size)
+                ]
+                classifier.detect_batch(images)  # Warm up this shape / thread count
+
+                timings = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    classifier.detect_batch(images)
+                    timings.append(time.perf_counter() - start)
+                latency = float(np.median(timings))
+
+                rows.append({
+                    'model': name,
+                    'intra_op_threads': threads,
+                    'inter_op_threads': torch.get_num_interop_threads(),
+                    'batch_size': batch_size,
+                    'latency_ms': round(latency * 1000, 1),
+                    'throughput': round(batch_size / latency, 2),
+                })
+                if latency * 1000 > latency_ms:
+                    break  # Bigger batches only get slower
+
+    return rows
+
+
+def choose(rows, latency_ms):
+    """
+    Best (intra, inter) configuration and per-model batch sizes
+
+    Returns:
+        Dictionary with the chosen settings, or None if no configuration
+        keeps every model under the latency ceiling
+    """
+    configs = {}
+    for row in rows:
+        key = (row['intra_op_threads'], row['inter_op_threads'])
+        configs.setdefault(key, []).append(row)
+
+    num_models = len({row['model'] for row in rows})
+    best = None
+    for (intra, inter), config_rows in configs.items():
+        per_model = {}
+        for row in config_rows:
+            if row['latency_ms'] > latency_ms:
+                continue
+            current = per_model.get(row['model'])
+            if current is None or row['throughput'] > current['throughput']:
+                per_model[row['model']] = row
+        if len(per_model) < num_models:
+            continue
+
+        score = math.exp(sum(math.log(row['throughput']) for row in per_model.values()) / num_models)
+        if best is None or score > best['score']:
+            best = {
+                'intra_op_threads': intra,
+                'inter_op_threads': inter,
+                'batch_sizes': {name: row['batch_size'] for name, row in per_model.items()},
+                'throughput': {name: row['throughput'] for name, row in per_model.items()},
+                'latency_ms': {name: row['latency_ms'] for name, row in per_model.items()},
+                'score': round(score, 2),
+            }
+    return best
+
+
+def autotune(models, latency_ms=AUTOTUNE_LATENCY_MS, interop_threads=None,
+             intra_threads=None, batch_sizes=BATCH_SIZES):
+    """
+    Tune and store the result for this host
+
+    Args:
+        models: Model names ('medium', 'large', ...) served together
+        latency_ms: Ceiling on the latency of one batch
+        interop_threads: Inter-op thread counts to try (default: 1, 2)
+        intra_threads: Intra-op thread counts to try (default: powers of
+                       two up to the core count)
+        batch_sizes: Batch sizes to try
+
+    Returns:
+        The stored tuning dictionary
+    """
+    cores = usable_cores()
+    interop_threads = interop_threads or [n for n in (1, 2) if n <= cores]
+    intra_threads = intra_threads or thread_options(cores)
+
+    rows = []
+    for interop in interop_threads:
+        print(f"Autotune: inter-op {interop}, intra-op {intra_threads}, batches {list(batch_sizes)}")
+        result = subprocess.run(
+            [
+                sys.executable, os.path.abspath(__file__), '--child',
+                '--models', ','.join(models),
+                '--interop', str(interop),
+                '--threads', ','.join(map(str, intra_threads)),
+                '--batch-sizes', ','.join(map(str, batch_sizes)),
+                '--latency-ms', str(latency_ms),
+            ],
+            stdout=subprocess.PIPE, check=True, text=True
+        )
+        rows.extend(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    best = choose(rows, latency_ms)
+    if best is None:
+        # Nothing meets the ceiling: fall back to the fastest batch-1 setup
+        fastest = min(
+            (row for row in rows if row['batch_size'] == 1),
+            key=lambda row: row['latency_ms']
+        )
+        best = choose(
+            [row for row in rows if row['intra_op_threads'] == fastest['intra_op_threads']
+             and row['inter_op_threads'] == fastest['inter_op_threads']
+             and row['batch_size'] == 1],
+            float('inf')
+        )
+        best['meets_ceiling'] = False
+    else:
+        best['meets_ceiling'] = True
+
+    fingerprint, host = host_fingerprint(models)
+    tuning = dict(best, fingerprint=fingerprint, host=host, latency_ceiling_ms=latency_ms,
+                  created=time.time(), results=rows)
+
+    os.makedirs(AUTOTUNE_DIR, exist_ok=True)
+    with open(os.path.join(AUTOTUNE_DIR, f'{fingerprint}.json'), 'w') as f:
+        json.dump(tuning, f, indent=2)
+    return tuning
+
+
+def load_tuning(models):
+    """Stored tuning for this host and model set, or None"""
+    fingerprint, _ = host_fingerprint(models)
+    path = os.path.join(AUTOTUNE_DIR, f'{fingerprint}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def apply_tuning(tuning):
+    """
+    Set torch's thread pools (call before any model is loaded)
+
+    Returns:
+        The tuning, for chaining
+    """
+    import torch
+
+    try:
+        torch.set_num_interop_threads(tuning['inter_op_threads'])
+    except RuntimeError:
+        # Inter-op pool already started (torch work ran before this call)
+        print("⚠ Autotune: inter-op threads already fixed, keeping "
+              f"{torch.get_num_interop_threads()}")
+    torch.set_num_threads(tuning['intra_op_threads'])
+    return tuning
+
+
+def startup_tuning(models, mode=AUTOTUNE):
+    """
+    Apply (and with mode 'run', first create) the tuning for this host
+
+    Args:
+        models: Model names this process will load
+        mode: 'apply', 'run' or 'off'
+
+    Returns:
+        Tuning dictionary, or None if none was applied
+    """
+    if mode == 'off' or not models:
+        return None
+
+    tuning = load_tuning(models)
+    if tuning is None and mode == 'run':
+        tuning = autotune(models)
+    if tuning is None:
+        return None
+
+    apply_tuning(tuning)
+    print(f"✓ Autotune ({tuning['fingerprint']}): {tuning['intra_op_threads']} intra-op / "
+          f"{tuning['inter_op_threads']} inter-op threads, batch sizes {tuning['batch_sizes']}")
+    return tuning
+
+
+def run_child(args):
+    """Measure one inter-op setting; prints the rows as JSON on the last line"""
+    import torch
+
+    # Must happen before any torch work in this process
+    torch.set_num_interop_threads(args.interop)
+
+    from app.inference_yolo import YOLOClassifier
+
+    models = {
+        name: YOLOClassifier(
+            model_size=MODEL_SIZES[name], optimize=OPTIMIZED_LOAD,
+            compile_mode=COMPILE_MODE, imgsz=INFERENCE_IMGSZ
+        )
+        for name in args.models.split(',')
+    }
+    rows = measure(
+        models,
+        [int(n) for n in args.threads.split(',')],
+        [int(n) for n in args.batch_sizes.split(',')],
+        args.latency_ms,
+    )
+    print(json.dumps(rows))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tune torch threads and batch size for this host')
+    parser.add_argument('--models', default=','.join(ENABLED_MODELS))
+    parser.add_argument('--latency-ms', type=float, default=AUTOTUNE_LATENCY_MS,
+                        help='Ceiling on the latency of one batch')
+    parser.add_argument('--threads', default=None, help='Intra-op thread counts, e.g. 2,4,8')
+    parser.add_argument('--interop', default=None, help='Inter-op thread counts, e.g. 1,2')
+    parser.add_argument('--batch-sizes', default=','.join(map(str, BATCH_SIZES)))
+    parser.add_argument('--force', action='store_true', help='Re-tune even if a result is stored')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.interop = int(args.interop)
+        run_child(args)
+        sys.exit(0)
+
+    models = args.models.split(',')
+    stored = None if args.force else load_tuning(models)
+    if stored:
+        print(f"Stored tuning for this host: {os.path.join(AUTOTUNE_DIR, stored['fingerprint'] + '.json')}"
+              " (use --force to re-run)")
+        sys.exit(0)
+
+    tuning = autotune(
+        models,
+        latency_ms=args.latency_ms,
+        interop_threads=[int(n) for n in args.interop.split(',')] if args.interop else None,
+        intra_threads=[int(n) for n in args.threads.split(',')] if args.threads else None,
+        batch_sizes=[int(n) for n in args.batch_sizes.split(',')],
+    )
+
+    print("=" * 60)
+    print(f"Host {tuning['fingerprint']}: {tuning['host']['cpu']} ({tuning['host']['cores']} cores)")
+    print(f"Intra-op threads: {tuning['intra_op_threads']}, inter-op threads: {tuning['inter_op_threads']}")
+    for name in models:
+        print(f"  {name}: batch {tuning['batch_sizes'][name]}, "
+              f"{tuning['throughput'][name]:.1f} img/s, {tuning['latency_ms'][name]:.0f} ms/batch")
+    if not tuning['meets_ceiling']:
+        print(f"⚠ No configuration stays under {args.latency_ms:.0f} ms; using the fastest batch-1 setup")
+    print("=" * 60)
@@ -0,0 +1,112 @@
+"""
+Latency benchmark for YOLOClassifier load modes
+
+Measures, for each configuration, the time from construction until the
+first request is answered (first-request latency) and the median / p95
+latency of the requests after it (steady-state latency).
+
+Usage:
+    python app/benchmark.py --model-size m --requests 20
+    python app/benchmark.py --model-size m --compile-mode torchscript
+    python app/benchmark.py --model-size m --labels
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import BASE_DIR
+from app.inference_yolo import YOLOClassifier
+
+
+def load_test_images():
+    """Load the bundled test images (or a synthetic one if none exist)"""
+    paths = sorted(glob.glob(os.path.join(BASE_DIR, 'test_images', '*.jpg')))
+    images = [Image.open(path).convert('RGB') for path in paths]
+    if not images:
+        rng = np.random.default_rng(0)
+        images = [Image.fromarray(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8))]
+    return images
+
+
+def percentile(values, q):
+    """Percentile of a list of seconds, in milliseconds"""
+    return float(np.percentile(values, q)) * 1000
+
+
+def run_benchmark(model_size, optimize, compile_mode, images, num_requests, labels_only=False):
+    """
+    Benchmark one load configuration
+
+    Args:
+        model_size: YOLOv8 size ('n', 's', 'm', 'l', 'x')
+        optimize: Use the optimized load mode
+        compile_mode: None, 'torchscript' or 'compile'
+        images: List of PIL images to cycle through
+        num_requests: Number of steady-state requests
+        labels_only: Benchmark predict_labels() instead of predict()
+
+    Returns:
+        Dictionary with load, first-request and steady-state timings
+    """
+    start = time.time()
+    classifier = YOLOClassifier(
+        model_size=model_size, optimize=optimize, compile_mode=compile_mode
+    )
+    predict = classifier.predict_labels if labels_only else classifier.predict
+    predict(images[0])
+    first_request = time.time() - start
+
+    latencies = []
+    for i in range(num_requests):
+        request_start = time.time()
+        predict(images[i % len(images)])
+        latencies.append(time.time() - request_start)
+
+    return {
+        'mode': ('optimized' if optimize else 'default') + (' labels' if labels_only else ''),
+        'compile_mode': compile_mode or '-',
+        'time_to_warm': classifier.time_to_warm,
+        'first_request': first_request,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark YOLOClassifier load modes')
+    parser.add_argument('--model-size', default='m')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--compile-mode', default=None, choices=['torchscript', 'compile'])
+    parser.add_argument('--labels', action='store_true',
+                        help='Also benchmark the label-only fast path')
+    args = parser.parse_args()
+
+    images = load_test_images()
+
+    configs = [(False, None, False), (True, None, False)]
+    if args.compile_mode:
+        configs.append((True, args.compile_mode, False))
+    if args.labels:
+        configs.append((True, None, True))
+
+    rows = [
+        run_benchmark(args.model_size, optimize, compile_mode, images, args.requests, labels_only)
+        for optimize, compile_mode, labels_only in configs
+    ]
+
+    print("=" * 85)
+    print(f"YOLOv8-{args.model_size} latency ({args.requests} requests, {len(images)} images)")
+    print("=" * 85)
+    print(f"{'mode':<17} {'compile':<12} {'warm (s)':>10} {'first req (s)':>14} "
+          f"{'p50 (ms)':>10} {'p95 (ms)':>10}")
+    for row in rows:
+        print(f"{row['mode']:<17} {row['compile_mode']:<12} {row['time_to_warm']:>10.2f} "
+              f"{row['first_request']:>14.2f} {row['p50_ms']:>10.1f} {row['p95_ms']:>10.1f}")
@@ -0,0 +1,208 @@
+"""
+Bulk tagging of an image folder
+
+Runs a YOLOv8 model over every image in a folder in batches and writes
+one JSON line per image (an 'error' line for images that can't be read
+or run; the rest of the folder is still tagged). With --dedup,
+near-duplicates (burst shots, re-exports, resized copies) are grouped by
+perceptual hash first and the model runs once per group (see
+app/dedup.py).
+
+Usage:
+    python app/bulk.py photos/ --output tags.jsonl
+    python app/bulk.py photos/ --dedup --max-distance 4 --labels
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from PIL import Image, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import ALLOWED_EXTENSIONS, MODEL_SIZES
+from app.dedup import dhash, group_near_duplicates, project_result
+from app.utils import allowed_file
+
+
+def find_images(folder):
+    """Image files under a folder, sorted"""
+    paths = []
+    for root, _, files in os.walk(folder):
+        paths.extend(
+            os.path.join(root, name) for name in files
+            if allowed_file(name, ALLOWED_EXTENSIONS)
+        )
+    return sorted(paths)
+
+
+def load_image(path):
+    """Decoded RGB image, upright (EXIF orientation applied, as dhash() sees it)"""
+    with Image.open(path) as image:
+        return ImageOps.exif_transpose(image).convert('RGB')
+
+
+def tag_images(classifier, paths, batch_size=8, dedup=False, max_distance=4, **options):
+    """
+    Run the classifier over a list of image files
+
+    Images that can't be read or run are reported and skipped; the rest of
+    the job carries on. A group whose representative fails is represented
+    by its next readable member.
+
+    Args:
+        classifier: YOLOClassifier (or anything with detect_batch)
+        paths: Image file paths
+        batch_size: Images per forward pass
+        dedup: Group near-duplicates and run the model once per group
+        max_distance: Hamming distance (of 64 bits) treated as a duplicate
+        **options: detect_batch() options (imgsz, rect, labels_only, ...)
+
+    Returns:
+        Tuple of (list of (path, detect() output or None if it failed,
+        duplicate_of path or None), report dictionary; report['errors']
+        maps failed paths to their error)
+    """
+    start = time.time()
+    errors = {}
+
+    if dedup:
+        readable, hashes, sizes = [], [], {}
+        for index, path in enumerate(paths):
+            try:
+                value, sizes[index] = dhash(path)
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                errors[index] = f'Cannot read image: {e}'
+                continue
+            readable.append(index)
+            hashes.append(value)
+        groups = [
+            [readable[position] for position, _ in group]
+            for group in group_near_duplicates(
+                hashes, [sizes[index] for index in readable], max_distance=max_distance
+            )
+        ]
+    else:
+        sizes = {}
+        groups = [[index] for index in range(len(paths))]
+    hash_time = time.time() - start
+
+    inference_start = time.time()
+    detected, representatives = {}, []
+    offset = 0
+    while offset < len(groups):  # Groups split off a failed batch are appended
+        batch, images = [], []
+        for group in groups[offset:offset + batch_size]:
+            # First member that decodes stands for the group
+            while group:
+                try:
+                    images.append(load_image(paths[group[0]]))
+                    batch.append(group)
+                    break
+                except (OSError, ValueError, Image.DecompressionBombError) as e:
+                    errors[group.pop(0)] = f'Cannot read image: {e}'
+
+        try:
+            outputs = classifier.detect_batch(images, **options) if images else []
+        except Exception:
+            # Find the image(s) that broke the batch, keep the others
+            outputs = []
+            for group, image in zip(batch, images):
+                try:
+                    outputs.append(classifier.detect_batch([image], **options)[0])
+                except Exception as e:
+                    errors[group[0]] = str(e)
+                    outputs.append(None)
+                    # Its duplicates are tried on their own
+                    groups.extend([index] for index in group[1:])
+                    del group[1:]
+
+        for group, output in zip(batch, outputs):
+            if output is not None:
+                detected[group[0]] = output
+                representatives.append(group)
+        offset += batch_size
+    inference_time = time.time() - inference_start
+
+    results = [(path, None, None) for path in paths]
+    for group in representatives:
+        rep_index = group[0]
+        results[rep_index] = (paths[rep_index], detected[rep_index], None)
+        for index in group[1:]:
+            width, height = sizes[index]
+            results[index] = (
+                paths[index], project_result(detected[rep_index], width, height), paths[rep_index]
+            )
+
+    tagged = sum(len(group) for group in representatives)
+    skipped = tagged - len(representatives)
+    per_image = inference_time / max(len(representatives), 1)
+    report = {
+        'images': len(paths),
+        'groups': len(representatives),
+        'inferences': len(representatives),
+        'skipped': skipped,
+        'failed': len(errors),
+        'compute_saved': skipped / max(tagged, 1),
+        'hash_time': hash_time,
+        'inference_time': inference_time,
+        # What the skipped images would have cost, minus what hashing cost
+        'time_saved': skipped * per_image - (hash_time if dedup else 0.0),
+        'errors': {paths[index]: message for index, message in sorted(errors.items())},
+    }
+    return results, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tag every image in a folder')
+    parser.add_argument('folder')
+    parser.add_argument('--output', default='-', help="JSON lines file ('-' for stdout)")
+    parser.add_argument('--model-size', default='m')
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='Images per forward pass (default: autotuned, else 8)')
+    parser.add_argument('--labels', action='store_true', help='Label-only fast path (no boxes)')
+    parser.add_argument('--dedup', action='store_true', help='Skip near-duplicates')
+    parser.add_argument('--max-distance', type=int, default=4,
+                        help='Hamming distance (of 64 bits) treated as a duplicate')
+    args = parser.parse_args()
+
+    from app.autotune import startup_tuning
+    from app.inference_yolo import YOLOClassifier
+
+    model_name = next((name for name, size in MODEL_SIZES.items() if size == args.model_size), None)
+    tuning = startup_tuning([model_name]) if model_name else None
+    batch_size = args.batch_size or (tuning['batch_sizes'][model_name] if tuning else 8)
+
+    paths = find_images(args.folder)
+    classifier = YOLOClassifier(model_size=args.model_size, threshold=args.threshold)
+    results, report = tag_images(
+        classifier, paths, batch_size=batch_size, dedup=args.dedup,
+        max_distance=args.max_distance, labels_only=args.labels
+    )
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    for path, detected, duplicate_of in results:
+        if detected is None:
+            output.write(json.dumps({'path': path, 'error': report['errors'][path]}) + '\n')
+            continue
+        if detected['detections'] is None:
+            record = classifier.format_predictions(detected)
+        else:
+            record = classifier.format_boxes(detected)
+        record.update({'path': path, 'duplicate_of': duplicate_of})
+        output.write(json.dumps(record) + '\n')
+    if output is not sys.stdout:
+        output.close()
+
+    print("=" * 60, file=sys.stderr)
+    print(f"Images: {report['images']}, groups: {report['groups']}, "
+          f"inferences: {report['inferences']}, failed: {report['failed']}", file=sys.stderr)
+    print(f"Skipped {report['skipped']} near-duplicates "
+          f"({report['compute_saved']:.0%} of the forward passes)", file=sys.stderr)
+    print(f"Hashing {report['hash_time']:.2f}s, inference {report['inference_time']:.2f}s, "
+          f"saved ~{report['time_saved']:.2f}s", file=sys.stderr)
+    print("=" * 60, file=sys.stderr)
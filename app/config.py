@@ -19,6 +19,22 @@ CLASS_NAMES = [
     'pottedplant', 'sheep', 'sofa', 'train', 'tvmonitor'
 ]
 
+# COCO (YOLOv8) class name -> PASCAL VOC class name, for label_set='voc'
+COCO_TO_VOC = {
+    'airplane': 'aeroplane', 'bicycle': 'bicycle', 'bird': 'bird', 'boat': 'boat',
+    'bottle': 'bottle', 'bus': 'bus', 'car': 'car', 'cat': 'cat', 'chair': 'chair',
+    'cow': 'cow', 'dining table': 'diningtable', 'dog': 'dog', 'horse': 'horse',
+    'motorcycle': 'motorbike', 'person': 'person', 'potted plant': 'pottedplant',
+    'sheep': 'sheep', 'couch': 'sofa', 'train': 'train', 'tv': 'tvmonitor',
+}
+
+# The same model converted to ONNX, served as model 'voc' through ONNX
+# Runtime (convert once with: python app/inference_voc.py --export).
+# VOC_MODEL=auto loads it when the file exists, 1 requires it, 0 skips it
+VOC_ONNX_PATH = os.environ.get('VOC_ONNX_PATH', os.path.join(BASE_DIR, 'models', 'model3.onnx'))
+VOC_MODEL = os.environ.get('VOC_MODEL', 'auto')
+VOC_NUM_THREADS = int(os.environ.get('VOC_NUM_THREADS', 1))
+
 # Prediction threshold
 PREDICTION_THRESHOLD = 0.5
 
@@ -27,6 +43,113 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
 
+# Upload memory bounds (see app/uploads.py)
+# Uploads above UPLOAD_SPOOL_BYTES are spooled to a temporary file; images
+# are rejected from their header alone above MAX_IMAGE_PIXELS or
+# MAX_IMAGE_SIDE; DECODE_BUDGET_BYTES caps the decoded pixels held across
+# concurrent requests (a request waits up to DECODE_WAIT_SECONDS for room)
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))
+MAX_IMAGE_SIDE = int(os.environ.get('MAX_IMAGE_SIDE', 16384))
+DECODE_BUDGET_BYTES = int(os.environ.get('DECODE_BUDGET_BYTES', 512 * 1024 * 1024))
+DECODE_WAIT_SECONDS = float(os.environ.get('DECODE_WAIT_SECONDS', 10))
+
+# Served YOLOv8 models: API name -> model size
+MODEL_SIZES = {'medium': 'm', 'large': 'l'}
+
+# Models this instance loads (e.g. ENABLED_MODELS=large for a large-only
+# instance behind the router)
+ENABLED_MODELS = [
+    name for name in os.environ.get('ENABLED_MODELS', ','.join(MODEL_SIZES)).split(',')
+    if name in MODEL_SIZES
+]
+
+# YOLOv8 load mode
+# OPTIMIZED_LOAD=1 fuses layers, uses channels-last and warms the model up
+# before the first request. COMPILE_MODE can be 'torchscript' or 'compile'.
+OPTIMIZED_LOAD = os.environ.get('OPTIMIZED_LOAD', '0') == '1'
+COMPILE_MODE = os.environ.get('COMPILE_MODE') or None
+INFERENCE_IMGSZ = int(os.environ.get('INFERENCE_IMGSZ', 640))
+WARMUP_BATCH_SIZES = tuple(
+    int(size) for size in os.environ.get('WARMUP_BATCH_SIZES', '1').split(',')
+)
+
+# Torch thread / batch-size autotuning (python app/autotune.py)
+# AUTOTUNE=apply uses the stored result for this host if there is one,
+# 'run' also tunes at startup when there isn't, 'off' ignores it
+AUTOTUNE = os.environ.get('AUTOTUNE', 'apply')
+AUTOTUNE_DIR = os.path.join(BASE_DIR, 'models', 'autotune')
+AUTOTUNE_LATENCY_MS = float(os.environ.get('AUTOTUNE_LATENCY_MS', 500))
+
+# Default /api/predict mode: 'detect' (full detector) or 'labels'
+# (classification branch only, no boxes / NMS)
+PREDICT_MODE = os.environ.get('PREDICT_MODE', 'detect')
+
+# Inference backend
+# 'local' runs the models inside the API process, 'worker' sends decoded
+# images to the inference workers in INFERENCE_WORKERS over shared memory,
+# 'spawn' starts one worker next to the API and uses it
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'local')
+WORKER_ADDRESSES = [
+    (address.rsplit(':', 1)[0], int(address.rsplit(':', 1)[1]))
+    for address in os.environ.get('INFERENCE_WORKERS', '127.0.0.1:6000').split(',')
+]
+# Shared secret for worker connections (they exchange pickled messages);
+# required for INFERENCE_BACKEND=worker, generated per start for 'spawn'
+WORKER_AUTHKEY = os.environ.get('WORKER_AUTHKEY', '').encode()
+WORKER_SLOTS = int(os.environ.get('WORKER_SLOTS', 8))  # Images in flight per web process
+WORKER_SLOT_BYTES = 2048 * 2048 * 3  # Larger uploads are downscaled to fit
+WORKER_MAX_BATCH = int(os.environ.get('WORKER_MAX_BATCH', 4))
+WORKER_BATCH_WAIT_MS = float(os.environ.get('WORKER_BATCH_WAIT_MS', 5))
+
+# Near-duplicate skipping in the batch paths (app/dedup.py): batches run by
+# the inference worker and client batches uploaded with batch_id.
+# Hamming distance (of 64 dHash bits) treated as a duplicate; -1 disables
+DEDUP_MAX_DISTANCE = int(os.environ.get('DEDUP_MAX_DISTANCE', 4))
+
+# Deadline-aware model selection (deadline_ms on the predict endpoints)
+# Models tried most accurate first; a prediction is the latency EWMA plus
+# LATENCY_DEVIATIONS mean deviations, plus the work queued on the model
+MODEL_ACCURACY_ORDER = ['large', 'medium', 'voc']
+LATENCY_DEVIATIONS = float(os.environ.get('LATENCY_DEVIATIONS', 2))
+# Relative cost (GFLOPs at 640) used to guess an unmeasured model's latency
+# from a measured one until both have run the same kind of request
+MODEL_RELATIVE_COST = {'medium': 78.9, 'large': 165.2}
+
+# Router in front of several API instances (api/router_app.py)
+ROUTER_BACKENDS = [
+    url for url in os.environ.get('ROUTER_BACKENDS', 'http://127.0.0.1:5000').split(',') if url
+]
+ROUTER_VIRTUAL_NODES = 100
+ROUTER_MAX_IMBALANCE = int(os.environ.get('ROUTER_MAX_IMBALANCE', 4))
+ROUTER_HEALTH_INTERVAL = float(os.environ.get('ROUTER_HEALTH_INTERVAL', 5))
+ROUTER_TIMEOUT = float(os.environ.get('ROUTER_TIMEOUT', 120))
+
+# Profiling and slow-request logging
+# Admin endpoints (/api/admin/...) are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_MAX_SECONDS = 60
+PROFILE_MIN_INTERVAL_MS = 1  # Finer sampling would hog the GIL
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 0))  # 0 disables
+
+# Annotated previews
+PREVIEW_CACHE_BYTES = int(os.environ.get('PREVIEW_CACHE_BYTES', 64 * 1024 * 1024))
+PREVIEW_DEFAULT_SIZE = 512
+PREVIEW_MAX_SIZE = 2048
+
+# Label index (persistent store of past detections)
+LABEL_INDEX_ENABLED = os.environ.get('LABEL_INDEX_ENABLED', '0') == '1'
+LABEL_INDEX_PATH = os.environ.get(
+    'LABEL_INDEX_PATH', os.path.join(BASE_DIR, 'index', 'labels.db')
+)
+
+# Vector index of backbone embeddings (for /api/similar), one per model
+VECTOR_INDEX_ENABLED = os.environ.get('VECTOR_INDEX_ENABLED', '0') == '1'
+VECTOR_INDEX_DIR = os.environ.get(
+    'VECTOR_INDEX_DIR', os.path.join(BASE_DIR, 'index', 'vectors')
+)
+
 # Create necessary directories
 os.makedirs(os.path.join(BASE_DIR, 'models'), exist_ok=True)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
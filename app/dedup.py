@@ -0,0 +1,300 @@
+"""
+Near-duplicate grouping for bulk processing
+
+Burst shots, re-exports and resized copies look the same to the model, so
+bulk jobs only need to run it once per group of near-duplicates:
+
+1. dHash: a 64-bit difference hash of a 9x8 grayscale thumbnail. JPEGs are
+   decoded at reduced scale (PIL draft mode), so hashing costs a fraction
+   of a full decode.
+2. Grouping: images are compared against the representative of every
+   existing group through a BK-tree (a metric tree over Hamming distance),
+   so each lookup only visits the branches that can be within range.
+3. Projection: the representative's result is copied onto the members,
+   with boxes rescaled to each member's size.
+
+Besides bulk folder jobs (app/bulk.py), the inference worker groups the
+images of each batch it runs (detect_unique) and the API remembers the
+results of client batches uploaded one image per request
+(BatchDuplicates).
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def dhash(source, hash_size=8):
+    """
+    Difference hash of an image
+
+    Files are hashed upright (EXIF orientation applied), so a rotated
+    re-export matches its original; images and arrays are hashed as given,
+    i.e. as the model sees them.
+
+    Args:
+        source: Image file path or file object, PIL image, or numpy array
+        hash_size: Hash is hash_size * hash_size bits
+
+    Returns:
+        Tuple of (hash as int, (width, height) of the full image, upright
+        for files)
+    """
+    if isinstance(source, np.ndarray):
+        # Only a few pixels per hash cell are needed: subsample first
+        step = max(min(source.shape[:2]) // (hash_size * 8), 1)
+        size = (source.shape[1], source.shape[0])
+        pixels = _difference_pixels(
+            Image.fromarray(np.ascontiguousarray(source[::step, ::step])), hash_size
+        )
+    elif isinstance(source, Image.Image):
+        size = source.size
+        pixels = _difference_pixels(source, hash_size)
+    else:
+        with Image.open(source) as image:
+            width, height = image.size
+            if image.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            size = (width, height)
+            # JPEG: let the decoder downscale by up to 8x while decoding
+            image.draft('L', (hash_size * 8, hash_size * 8))
+            pixels = _difference_pixels(ImageOps.exif_transpose(image), hash_size)
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value, size
+
+
+def _difference_pixels(image, hash_size):
+    """Grayscale (hash_size + 1) x hash_size thumbnail, row-major"""
+    return list(
+        image.convert('L')
+        .resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+        .getdata()
+    )
+
+
+def same_aspect(size, other, tolerance=0.05):
+    """Whether two (width, height) sizes have about the same aspect ratio"""
+    return abs(math.log(size[0] / size[1]) - math.log(other[0] / other[1])) <= tolerance
+
+
+def hamming(a, b):
+    """Number of differing bits"""
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, item, {distance: child}]
+
+    def add(self, value, item):
+        """Insert a hash with an attached item"""
+        if self.root is None:
+            self.root = [value, item, {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, item, {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """
+        All stored items within max_distance
+
+        Returns:
+            List of (distance, item), closest first
+        """
+        matches = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                matches.append((distance, node[1]))
+            # Triangle inequality: only children in this band can match
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(matches, key=lambda match: match[0])
+
+
+def group_near_duplicates(hashes, sizes, max_distance=4, aspect_tolerance=0.05):
+    """
+    Greedy grouping of near-duplicate images
+
+    Each image joins the closest existing group whose representative is
+    within max_distance bits and has about the same aspect ratio (so a
+    crop doesn't borrow the boxes of the full frame); otherwise it starts
+    a new group. Comparing against representatives only keeps groups from
+    drifting through chains of small differences.
+
+    Args:
+        hashes: dhash() value of every image
+        sizes: (width, height) of every image
+        max_distance: Largest Hamming distance treated as a duplicate
+        aspect_tolerance: Largest relative aspect ratio difference
+
+    Returns:
+        List of groups; each is a list of (image index, distance to the
+        representative), representative first
+    """
+    tree = BKTree()
+    groups = []
+
+    for index, (value, size) in enumerate(zip(hashes, sizes)):
+        for distance, group_id in tree.search(value, max_distance):
+            if same_aspect(size, sizes[groups[group_id][0][0]], aspect_tolerance):
+                groups[group_id].append((index, distance))
+                break
+        else:
+            tree.add(value, len(groups))
+            groups.append([(index, 0)])
+
+    return groups
+
+
+def project_result(detected, width, height):
+    """
+    Copy a detect() output onto a same-content image of another size
+
+    Args:
+        detected: detect() output of the group representative
+        width, height: Size of the member image
+
+    Returns:
+        New detect() output with boxes in the member's pixel space
+    """
+    scale_x = width / detected['width']
+    scale_y = height / detected['height']
+
+    projected = dict(detected, width=width, height=height, inference_time=0.0)
+    if detected['detections'] is not None:
+        projected['detections'] = [
+            dict(d, box=[
+                d['box'][0] * scale_x, d['box'][1] * scale_y,
+                d['box'][2] * scale_x, d['box'][3] * scale_y,
+            ])
+            for d in detected['detections']
+        ]
+    return projected
+
+
+def detect_unique(detect_batch, images, max_distance=4, **options):
+    """
+    Run detect_batch() on the distinct images of a batch only
+
+    Args:
+        detect_batch: Callable taking (images, **options), e.g.
+                      YOLOClassifier.detect_batch
+        images: PIL images or numpy arrays
+        max_distance: Hamming distance (of 64 bits) treated as a duplicate
+        **options: detect_batch() options
+
+    Returns:
+        Tuple of (detect() outputs in input order, list of the index of
+        the image each result was projected from, None if it ran)
+    """
+    hashes, sizes = zip(*(dhash(image) for image in images)) if images else ((), ())
+    groups = group_near_duplicates(hashes, sizes, max_distance=max_distance)
+    if len(groups) == len(images):
+        return detect_batch(images, **options), [None] * len(images)
+
+    representatives = [group[0][0] for group in groups]
+    detected = dict(zip(
+        representatives, detect_batch([images[index] for index in representatives], **options)
+    ))
+
+    outputs, sources = [None] * len(images), [None] * len(images)
+    for group in groups:
+        rep_index = group[0][0]
+        outputs[rep_index] = detected[rep_index]
+        for index, _ in group[1:]:
+            outputs[index] = project_result(detected[rep_index], *sizes[index])
+            sources[index] = rep_index
+    return outputs, sources
+
+
+class BatchDuplicates:
+    """
+    Near-duplicate lookup across the requests of client batches
+
+    Clients that upload a batch one image per request tag the requests
+    with a shared batch id; results of the batch's earlier images are kept
+    (per batch and result kind) so a near-duplicate is answered by
+    projection instead of inference. Only the most recently used batches
+    are kept.
+    """
+
+    def __init__(self, max_distance=4, max_batches=32, max_images=1000,
+                 aspect_tolerance=0.05):
+        """
+        Args:
+            max_distance: Hamming distance (of 64 bits) treated as a duplicate
+            max_batches: Batches remembered at once (least recently used
+                         are dropped)
+            max_images: Results remembered per batch
+            aspect_tolerance: Largest relative aspect ratio difference
+        """
+        self.max_distance = max_distance
+        self.max_batches = max_batches
+        self.max_images = max_images
+        self.aspect_tolerance = aspect_tolerance
+        self._batches = OrderedDict()  # batch id -> {key: (BKTree, [entries])}
+        self._lock = threading.Lock()
+
+    def find(self, batch_id, key, value, size):
+        """
+        Result of an earlier near-duplicate in the batch
+
+        Args:
+            batch_id: Client batch id
+            key: Kind of result (model and options) that must match
+            value, size: dhash() of the image
+
+        Returns:
+            Tuple of (reference of the earlier image, its detect() output)
+            or None
+        """
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None or key not in batch:
+                return None
+            self._batches.move_to_end(batch_id)
+            tree, entries = batch[key]
+            for _, entry in tree.search(value, self.max_distance):
+                entry_size, ref, detected = entries[entry]
+                if same_aspect(size, entry_size, self.aspect_tolerance):
+                    return ref, detected
+        return None
+
+    def add(self, batch_id, key, value, size, ref, detected):
+        """Remember the result of an image that ran (see find())"""
+        with self._lock:
+            batch = self._batches.setdefault(batch_id, {})
+            self._batches.move_to_end(batch_id)
+            while len(self._batches) > self.max_batches:
+                self._batches.popitem(last=False)
+
+            tree, entries = batch.setdefault(key, (BKTree(), []))
+            if len(entries) < self.max_images:
+                tree.add(value, len(entries))
+                entries.append((size, ref, detected))
@@ -0,0 +1,120 @@
+"""
+Response formatting shared by every detector backend
+
+Kept free of torch/ultralytics imports so processes that only format
+results (e.g. web workers talking to a remote inference process) stay light.
+"""
+
+
+class DetectionFormatter:
+    """
+    Builds the API responses from detect() output
+
+    Subclasses provide `class_names` (dict of id -> name), `model_size`
+    and `threshold`.
+    """
+
+    # Whether detect() returns boxes (label-only backends set this False)
+    has_boxes = True
+
+    # Whether detect() accepts embed=True
+    has_embeddings = False
+
+    def model_label(self):
+        """Model name reported as 'model_info'"""
+        return f'YOLOv8-{self.model_size}'
+
+    def format_predictions(self, detected, threshold=None):
+        """
+        Build the multi-label response used by predict()
+
+        Args:
+            detected: Output of detect() (or a stored copy of it)
+            threshold: Threshold to report (defaults to self.threshold)
+
+        Returns:
+            Dictionary with prediction results
+        """
+        if threshold is None:
+            threshold = self.threshold
+
+        detected_objects = []
+        all_predictions = {}
+        binary_predictions = {}
+
+        # Initialize all reported classes as 0 (a class filter or label
+        # projection narrows them down)
+        for class_name in detected.get('classes') or self.class_names.values():
+            all_predictions[class_name] = 0.0
+            binary_predictions[class_name] = 0
+
+        if detected['detections'] is None:
+            # Label-only result: per-class scores, no boxes
+            for class_name, score in sorted(
+                detected['scores'].items(), key=lambda x: x[1], reverse=True
+            ):
+                all_predictions[class_name] = score
+                if score >= threshold:
+                    detected_objects.append(class_name)
+                    binary_predictions[class_name] = 1
+
+        for detection in detected['detections'] or []:
+            class_name = detection['class']
+            confidence = detection['confidence']
+
+            # Update with highest confidence for each class
+            if confidence > all_predictions[class_name]:
+                all_predictions[class_name] = confidence
+
+            # Add to detected objects if not already there
+            if class_name not in detected_objects:
+                detected_objects.append(class_name)
+                binary_predictions[class_name] = 1
+
+        # Sort all_predictions for better display
+        all_predictions = dict(sorted(
+            all_predictions.items(),
+            key=lambda x: x[1],
+            reverse=True
+        ))
+
+        return {
+            'detected_objects': detected_objects,
+            'all_predictions': all_predictions,
+            'binary_predictions': binary_predictions,
+            'threshold': threshold,
+            'num_detected': len(detected_objects),
+            'model_trained': True,  # Pre-trained model
+            'model_info': self.model_label(),
+        }
+
+    def format_boxes(self, detected, threshold=None):
+        """
+        Build the bounding box response used by predict_with_boxes()
+
+        Args:
+            detected: Output of detect() (or a stored copy of it)
+            threshold: Threshold to report (defaults to self.threshold)
+
+        Returns:
+            Dictionary with detections, image size and inference time
+        """
+        if threshold is None:
+            threshold = self.threshold
+
+        detections = detected['detections']
+
+        # Get unique detected objects
+        detected_objects = list(set([d['class'] for d in detections]))
+
+        return {
+            'detections': detections,
+            'detected_objects': detected_objects,
+            'num_detected': len(detections),
+            'threshold': threshold,
+            'model_info': self.model_label(),
+            'width': detected['width'],
+            'height': detected['height'],
+            'input_size': detected.get('input_size'),
+            'inference_time': detected['inference_time']
+        }
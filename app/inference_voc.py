@@ -0,0 +1,332 @@
+"""
+PASCAL VOC Inference Module - the original 100x100 multi-label CNN
+
+The small Keras model from the project notebook (20 sigmoid outputs, one
+per VOC class) served through ONNX Runtime on the CPU, so neither
+TensorFlow nor torch is needed at serving time. Convert the trained
+weights once with:
+
+    python app/inference_voc.py --export
+
+It returns per-class scores only (no boxes), in the same format as the
+YOLOv8 label-only path, and is registered in the API as model 'voc'.
+"""
+
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+# Allow running this file directly (python app/inference_voc.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import BASE_DIR, CLASS_NAMES, MODEL_INPUT_SHAPE, MODEL_PATH, VOC_ONNX_PATH
+from app.detections import DetectionFormatter
+from app.utils import preprocess_image
+
+
+class VOCClassifier(DetectionFormatter):
+    """
+    Multi-Label Image Classifier using the 100x100 VOC CNN
+    Trained on PASCAL VOC 2007 (20 classes)
+    """
+
+    # Scores only: predict_with_boxes() is not available
+    has_boxes = False
+
+    def __init__(self, model_path=VOC_ONNX_PATH, threshold=0.5, num_threads=1):
+        """
+        Initialize the VOC classifier
+
+        Args:
+            model_path: ONNX export of the Keras model (see export_onnx)
+            threshold: Probability threshold (0.0 to 1.0)
+            num_threads: ONNX Runtime intra-op threads; the model is tiny, so
+                         one thread per request beats splitting each one
+        """
+        # Imported here so the API only needs onnxruntime when 'voc' is served
+        import onnxruntime
+
+        self.threshold = threshold
+        self.model_size = 'voc'
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.class_names = dict(enumerate(CLASS_NAMES))
+        self.input_shape = MODEL_INPUT_SHAPE  # (height, width, channels)
+
+        print(f"Loading VOC model: {model_path}")
+        load_start = time.time()
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            model_path, sess_options=options, providers=['CPUExecutionProvider']
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+        self.load_time = time.time() - load_start
+
+        # One pass so the first request doesn't pay for allocation
+        self.warmup_time = self.warmup()
+
+        print("✓ Model loaded: VOC-CNN-100x100 (onnxruntime)")
+        print(f"✓ Classes: {len(self.class_names)}")
+
+    def model_label(self):
+        """Model name reported as 'model_info'"""
+        return 'VOC-CNN-100x100'
+
+    def warmup(self, batch_size=1):
+        """
+        Run one forward pass on blank images
+
+        Returns:
+            Seconds taken by the pass
+        """
+        blank = np.zeros((batch_size,) + self.input_shape, dtype=np.float32)
+        start = time.time()
+        self._run(blank)
+        return time.time() - start
+
+    def _run(self, batch):
+        """(B, 20) class probabilities for a (B, 100, 100, 3) float batch"""
+        outputs = self.session.run(None, {self.input_name: batch})
+        # Exports keep either one (B, 20) output or the notebook's twenty
+        # (B, 1) heads; both flatten to the VOC class order
+        return np.concatenate([output.reshape(len(batch), -1) for output in outputs], axis=1)
+
+    @staticmethod
+    def _load_image(image_data):
+        """PIL image from bytes, a file path, a BGR numpy array or a PIL image"""
+        if isinstance(image_data, np.ndarray):
+            # Same convention as the YOLO backend: numpy input is BGR
+            return Image.fromarray(np.ascontiguousarray(image_data[..., ::-1]))
+        if isinstance(image_data, bytes):
+            return Image.open(io.BytesIO(image_data))
+        if isinstance(image_data, str):
+            return Image.open(image_data)
+        return image_data
+
+    def resolve_classes(self, classes=None, label_set='voc'):
+        """
+        Work out which classes a request reports
+
+        Args:
+            classes: Optional list of VOC class names to keep
+            label_set: Must be 'voc'; this model knows no other classes
+
+        Returns:
+            Dict of class id -> name
+        """
+        if label_set not in (None, 'voc'):
+            raise ValueError("The VOC model only supports label_set 'voc'")
+
+        names = dict(self.class_names)
+        if classes:
+            unknown = sorted(set(classes) - set(names.values()))
+            if unknown:
+                raise ValueError(f"Unknown classes for label_set 'voc': {', '.join(unknown)}")
+            names = {class_id: name for class_id, name in names.items() if name in classes}
+        return names
+
+    def detect(self, image_data, **options):
+        """
+        Score one image
+
+        Args:
+            image_data: PIL Image, numpy array, bytes or file path
+            **options: classes, label_set (see detect_batch)
+
+        Returns:
+            Dictionary with 'detections' (None), 'scores', 'classes',
+            'width', 'height', 'input_size' and 'inference_time'
+        """
+        return self.detect_batch([image_data], **options)[0]
+
+    def detect_batch(self, images, imgsz=None, rect=False, labels_only=True,
+                     classes=None, label_set='voc'):
+        """
+        Score several images in one session run
+
+        Args:
+            images: List of PIL Images, numpy arrays, bytes or file paths
+            imgsz, rect: Not supported; the network input is fixed at 100x100
+            labels_only: Ignored (this model only produces labels)
+            classes: Only report these class names
+            label_set: 'voc'
+
+        Returns:
+            List of detect() outputs, in input order. 'inference_time' is
+            the batch time divided evenly between the images.
+        """
+        if imgsz or rect:
+            raise ValueError('The VOC model has a fixed 100x100 input (imgsz/rect not supported)')
+
+        names = self.resolve_classes(classes, label_set)
+
+        images = [self._load_image(image_data) for image_data in images]
+        height, width = self.input_shape[:2]
+
+        start = time.time()
+        batch = np.concatenate([
+            preprocess_image(image, target_size=(width, height)) for image in images
+        ])
+        probabilities = self._run(batch)
+        inference_time = (time.time() - start) / max(len(images), 1)
+
+        outputs = []
+        for image, image_scores in zip(images, probabilities.tolist()):
+            outputs.append({
+                'detections': None,
+                'scores': {name: image_scores[class_id] for class_id, name in names.items()},
+                'classes': list(names.values()),
+                'width': image.width,
+                'height': image.height,
+                'input_size': [height, width],
+                'inference_time': inference_time,
+            })
+
+        return outputs
+
+    def predict(self, image_data, classes=None, label_set='voc', **options):
+        """
+        Make predictions on an image
+
+        Args:
+            image_data: PIL Image, numpy array, bytes or file path
+            classes: Only report these class names (e.g. ['dog', 'person'])
+            label_set: 'voc'
+
+        Returns:
+            Dictionary with prediction results (same schema as YOLOClassifier)
+        """
+        return self.format_predictions(self.detect(
+            image_data, classes=classes, label_set=label_set, **options
+        ))
+
+    def predict_labels(self, image_data, **options):
+        """Same as predict(); every VOC prediction is label-only"""
+        return self.predict(image_data, **options)
+
+    def predict_with_boxes(self, image_data, **options):
+        """The VOC CNN is a classifier and has no boxes to return"""
+        raise ValueError("Model 'voc' returns labels only (no bounding boxes)")
+
+    def set_threshold(self, new_threshold):
+        """Update probability threshold"""
+        if 0.0 <= new_threshold <= 1.0:
+            self.threshold = new_threshold
+            print(f"Threshold updated to {new_threshold}")
+        else:
+            raise ValueError("Threshold must be between 0.0 and 1.0")
+
+    def get_model_info(self):
+        """Get model information"""
+        return {
+            "model_type": "VOC CNN",
+            "model_size": self.model_size,
+            "model_trained": True,
+            "num_classes": len(self.class_names),
+            "class_names": list(self.class_names.values()),
+            "threshold": self.threshold,
+            "pretrained_on": "PASCAL VOC 2007",
+            "input_shape": list(self.input_shape),
+            "runtime": "onnxruntime",
+            "num_threads": self.num_threads,
+            "boxes": False,
+            "load_time": self.load_time,
+            "warmup_time": self.warmup_time,
+        }
+
+
+def build_keras_model():
+    """
+    Rebuild the notebook's model3 architecture (for loading its weights)
+
+    Returns:
+        Uncompiled tf.keras Model with one (B, 1) sigmoid head per class
+    """
+    from tensorflow.keras import layers, Model
+
+    inp = layers.Input(shape=MODEL_INPUT_SHAPE)
+    x = layers.Conv2D(32, (3, 3), padding='same')(inp)
+    x = layers.Activation('relu')(x)
+    x = layers.Conv2D(32, (3, 3))(x)
+    x = layers.Activation('relu')(x)
+    x = layers.MaxPooling2D(pool_size=(2, 2))(x)
+    x = layers.Dropout(0.25)(x)
+    x = layers.Conv2D(64, (3, 3), padding='same')(x)
+    x = layers.Activation('relu')(x)
+    x = layers.Conv2D(64, (3, 3))(x)
+    x = layers.Activation('relu')(x)
+    x = layers.MaxPooling2D(pool_size=(2, 2))(x)
+    x = layers.Dropout(0.25)(x)
+    x = layers.Flatten()(x)
+    x = layers.Dense(512)(x)
+    x = layers.Activation('relu')(x)
+    x = layers.Dropout(0.5)(x)
+    outputs = [layers.Dense(1, activation='sigmoid')(x) for _ in CLASS_NAMES]
+    return Model(inp, outputs)
+
+
+def export_onnx(weights_path=MODEL_PATH, onnx_path=VOC_ONNX_PATH, opset=13):
+    """
+    Convert the trained Keras weights to ONNX (needs tensorflow and tf2onnx,
+    only for this one-off step)
+
+    The twenty heads are concatenated into a single (B, 20) output and the
+    batch dimension is left dynamic, so the session can score batches.
+
+    Args:
+        weights_path: Keras .h5 weights saved from the notebook
+        onnx_path: Where to write the ONNX model
+        opset: ONNX opset version
+
+    Returns:
+        Path of the written ONNX model
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    model = build_keras_model()
+    model.load_weights(weights_path)
+    model = tf.keras.Model(model.input, tf.keras.layers.Concatenate()(model.outputs))
+
+    signature = [tf.TensorSpec((None,) + MODEL_INPUT_SHAPE, tf.float32, name='image')]
+    tf2onnx.convert.from_keras(
+        model, input_signature=signature, opset=opset, output_path=onnx_path
+    )
+    print(f"✓ Exported {weights_path} -> {onnx_path}")
+    return onnx_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='VOC CNN (ONNX Runtime) backend')
+    parser.add_argument('--export', action='store_true',
+                        help='Convert the Keras weights to ONNX first')
+    parser.add_argument('--weights', default=MODEL_PATH)
+    parser.add_argument('--onnx', default=VOC_ONNX_PATH)
+    args = parser.parse_args()
+
+    if args.export:
+        export_onnx(args.weights, args.onnx)
+
+    print("=" * 60)
+    print("VOC Multi-Label Classifier Test")
+    print("=" * 60)
+
+    classifier = VOCClassifier(model_path=args.onnx)
+    paths = sorted(glob.glob(os.path.join(BASE_DIR, 'test_images', '*.jpg')))
+    if paths:
+        for path, detected in zip(paths, classifier.detect_batch(paths)):
+            predictions = classifier.format_predictions(detected)
+            print(f"  {os.path.basename(path)}: {', '.join(predictions['detected_objects']) or '-'}"
+                  f" ({detected['inference_time'] * 1000:.2f} ms/image)")
+    print("=" * 60)
@@ -0,0 +1,618 @@
+"""
+Dedicated inference worker process fed over shared memory
+
+The worker process owns the YOLOClassifier models; web processes only decode
+uploads and format responses. Pixel data never goes through pickle: every
+web process creates a shared-memory ring buffer of fixed-size slots, writes
+the decoded image into a free slot and sends the worker a small control
+message (slot, shape, model, threshold). The worker reads the slot in place,
+batches requests per model and sends back the compact detection results.
+
+Run a worker:
+    python app/inference_worker.py --address 127.0.0.1:6000 --models medium,large
+
+and point the API at it with INFERENCE_BACKEND=worker (or use
+INFERENCE_BACKEND=spawn to start one next to the API automatically).
+"""
+
+import argparse
+import atexit
+import io
+import itertools
+import math
+import os
+import queue
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from PIL import Image
+
+# Allow running this file directly (python app/inference_worker.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import (
+    MODEL_SIZES, WORKER_ADDRESSES, WORKER_AUTHKEY, WORKER_SLOTS,
+    WORKER_SLOT_BYTES, WORKER_MAX_BATCH, WORKER_BATCH_WAIT_MS,
+    OPTIMIZED_LOAD, COMPILE_MODE, INFERENCE_IMGSZ, DEDUP_MAX_DISTANCE,
+)
+from app.dedup import detect_unique
+from app.detections import DetectionFormatter
+
+
+def parse_address(address):
+    """'host:port' -> (host, port)"""
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def check_authkey(authkey):
+    """Refuse to listen or connect without a shared secret"""
+    if not authkey:
+        raise ValueError(
+            'WORKER_AUTHKEY is not set; worker connections exchange pickled '
+            'messages and need a shared secret'
+        )
+    return authkey
+
+
+class SharedRingBuffer:
+    """
+    Fixed-size image slots in one shared-memory segment
+
+    The creating (web) process owns slot allocation; the worker attaches by
+    name and only reads the slots it is told about.
+    """
+
+    def __init__(self, num_slots, slot_bytes, name=None):
+        """
+        Create a new ring, or attach to an existing one
+
+        Args:
+            num_slots: Number of slots
+            slot_bytes: Size of each slot (max H * W * 3 bytes per image)
+            name: Name of an existing segment to attach to
+        """
+        self.num_slots = num_slots
+        self.slot_bytes = slot_bytes
+        self.owner = name is None
+
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=num_slots * slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Only the creator may unlink the segment; stop this process's
+            # resource tracker from removing it at exit
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+        self._free = queue.Queue()
+        if self.owner:
+            for slot in range(num_slots):
+                self._free.put(slot)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def acquire(self, timeout=None):
+        """Take a free slot, waiting up to `timeout` seconds"""
+        try:
+            return self._free.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError('No free shared-memory slot for the image')
+
+    def release(self, slot):
+        """Return a slot to the free list"""
+        self._free.put(slot)
+
+    def view(self, slot, shape):
+        """numpy view of an image stored in a slot (no copy)"""
+        return np.ndarray(
+            shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes
+        )
+
+    def write(self, slot, pixels):
+        """Copy an H x W x 3 uint8 image into a slot"""
+        self.view(slot, pixels.shape)[...] = pixels
+
+    def close(self):
+        """Detach (and unlink, for the owner)"""
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class InferenceServer:
+    """
+    Owns the models and batches requests from all connected web processes
+    """
+
+    def __init__(self, classifiers, max_batch=WORKER_MAX_BATCH,
+                 batch_wait_ms=WORKER_BATCH_WAIT_MS, batch_sizes=None,
+                 dedup_distance=DEDUP_MAX_DISTANCE):
+        """
+        Args:
+            classifiers: Dict of model name -> YOLOClassifier
+            max_batch: Largest batch handed to detect_batch()
+            batch_wait_ms: How long to wait for a batch to fill up
+            batch_sizes: Per-model overrides of max_batch (from autotune)
+            dedup_distance: Near-duplicates within a batch (dHash Hamming
+                            distance up to this) run once; -1 disables
+        """
+        self.classifiers = classifiers
+        self.max_batch = max_batch
+        self.batch_sizes = batch_sizes or {}
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.dedup_distance = dedup_distance
+
+        self._jobs = {name: deque() for name in classifiers}
+        self._conditions = {name: threading.Condition() for name in classifiers}
+
+        for name in classifiers:
+            threading.Thread(target=self._batch_loop, args=(name,), daemon=True).start()
+
+    def model_info(self):
+        """Model details sent to clients on attach"""
+        return {
+            name: {
+                'model_size': classifier.model_size,
+                'class_names': dict(classifier.class_names),
+                'info': classifier.get_model_info(),
+            }
+            for name, classifier in self.classifiers.items()
+        }
+
+    def serve_forever(self, address, authkey=WORKER_AUTHKEY):
+        """Accept web-process connections until interrupted"""
+        with Listener(address, authkey=check_authkey(authkey)) as listener:
+            print(f"✓ Inference worker listening on {address[0]}:{address[1]}")
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._handle_client, args=(conn,), daemon=True).start()
+
+    def _handle_client(self, conn):
+        """Read control messages from one web process"""
+        send_lock = threading.Lock()
+        ring = None
+
+        try:
+            while True:
+                message = conn.recv()
+
+                if message[0] == 'attach':
+                    _, name, num_slots, slot_bytes = message
+                    ring = SharedRingBuffer(num_slots, slot_bytes, name=name)
+                    with send_lock:
+                        conn.send(('models', self.model_info()))
+
+                elif message[0] == 'detect':
+                    _, request_id, model, slot, shape, threshold, options = message
+                    job = {
+                        'conn': conn,
+                        'send_lock': send_lock,
+                        'ring': ring,
+                        'request_id': request_id,
+                        'slot': slot,
+                        'shape': shape,
+                        'threshold': threshold,
+                        'options': options,
+                    }
+                    if model not in self._jobs:
+                        self._reply(job, ('error', request_id, f'Model not loaded: {model}'))
+                        continue
+                    with self._conditions[model]:
+                        self._jobs[model].append(job)
+                        self._conditions[model].notify()
+
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            if ring is not None:
+                self._detach(ring)
+
+    def _detach(self, ring, timeout=10.0):
+        """Drop a disconnected client's queued jobs and unmap its ring"""
+        for model, jobs in self._jobs.items():
+            with self._conditions[model]:
+                kept = [job for job in jobs if job['ring'] is not ring]
+                jobs.clear()
+                jobs.extend(kept)
+
+        # A batch may still be reading from the ring; its views are dropped
+        # when it finishes
+        deadline = time.time() + timeout
+        while True:
+            try:
+                ring.close()
+                return
+            except BufferError:
+                if time.time() >= deadline:
+                    print(f"⚠ Inference worker: ring {ring.name} still in use, leaving it mapped")
+                    return
+                time.sleep(0.05)
+
+    def _batch_loop(self, model):
+        """Collect compatible jobs for one model and run them together"""
+        jobs = self._jobs[model]
+        condition = self._conditions[model]
+        classifier = self.classifiers[model]
+        max_batch = self.batch_sizes.get(model, self.max_batch)
+
+        while True:
+            with condition:
+                while not jobs:
+                    condition.wait()
+
+                deadline = time.time() + self.batch_wait
+                while len(jobs) < max_batch:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    condition.wait(remaining)
+
+                # Jobs in one batch must share threshold and input options
+                first = jobs[0]
+                key = (first['threshold'], sorted(first['options'].items()))
+                batch = [
+                    job for job in jobs
+                    if (job['threshold'], sorted(job['options'].items())) == key
+                ][:max_batch]
+                for job in batch:
+                    jobs.remove(job)
+
+            self._run_batch(classifier, batch)
+
+    def _run_batch(self, classifier, batch):
+        """Run one batch straight from the shared-memory slots"""
+        images = [job['ring'].view(job['slot'], job['shape']) for job in batch]
+
+        try:
+            classifier.threshold = batch[0]['threshold']
+            if self.dedup_distance >= 0 and len(images) > 1:
+                outputs, _ = detect_unique(
+                    classifier.detect_batch, images, max_distance=self.dedup_distance,
+                    **batch[0]['options']
+                )
+            else:
+                outputs = classifier.detect_batch(images, **batch[0]['options'])
+            replies = [
+                ('result', job['request_id'], output)
+                for job, output in zip(batch, outputs)
+            ]
+        except Exception as e:
+            replies = [('error', job['request_id'], str(e)) for job in batch]
+        finally:
+            # Drop the views (ours and the predictor's) before the client
+            # may reuse the slots or detach the ring
+            classifier.release_inputs()
+            del images
+
+        for job, reply in zip(batch, replies):
+            self._reply(job, reply)
+
+    @staticmethod
+    def _reply(job, reply):
+        try:
+            with job['send_lock']:
+                job['conn'].send(reply)
+        except (EOFError, OSError):
+            pass  # Client went away
+
+
+class WorkerClient:
+    """
+    Connection from a web process to one inference worker
+    """
+
+    def __init__(self, address, authkey=WORKER_AUTHKEY, num_slots=WORKER_SLOTS,
+                 slot_bytes=WORKER_SLOT_BYTES, connect_timeout=0):
+        """
+        Args:
+            address: (host, port) of the worker
+            authkey: Shared secret for the connection
+            num_slots: Number of images that can be in flight at once
+            slot_bytes: Max decoded image size; larger images are downscaled
+            connect_timeout: Keep retrying the connection this many seconds
+                             (useful while a freshly started worker loads)
+        """
+        check_authkey(authkey)
+        deadline = time.time() + connect_timeout
+        while True:
+            try:
+                self.conn = Client(address, authkey=authkey)
+                break
+            except ConnectionRefusedError:
+                if time.time() >= deadline:
+                    raise
+                time.sleep(1.0)
+
+        self.ring = SharedRingBuffer(num_slots, slot_bytes)
+        atexit.register(self.close)
+
+        self.conn.send(('attach', self.ring.name, num_slots, slot_bytes))
+        _, self.models = self.conn.recv()
+
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    @property
+    def num_pending(self):
+        return len(self._pending)
+
+    def _read_loop(self):
+        """Resolve futures as results arrive"""
+        try:
+            while True:
+                kind, request_id, payload = self.conn.recv()
+                with self._pending_lock:
+                    future, slot, original_size, input_size = self._pending.pop(request_id)
+
+                # The worker is done with the slot once it has replied
+                self.ring.release(slot)
+
+                if kind == 'result':
+                    future.set_result(self._rescale(payload, original_size, input_size))
+                else:
+                    future.set_exception(RuntimeError(payload))
+
+        except (EOFError, OSError):
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for future, _, _, _ in pending.values():
+                future.set_exception(ConnectionError('Inference worker disconnected'))
+
+    @staticmethod
+    def _rescale(detected, original_size, input_size):
+        """Map boxes from a downscaled upload back to the original image"""
+        if original_size == input_size:
+            return detected
+
+        scale_x = original_size[0] / input_size[0]
+        scale_y = original_size[1] / input_size[1]
+        for detection in detected['detections'] or []:
+            x1, y1, x2, y2 = detection['box']
+            detection['box'] = [x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y]
+        detected['width'], detected['height'] = original_size
+        return detected
+
+    def _to_pixels(self, image_data):
+        """Decode an upload into a BGR uint8 array that fits in one slot"""
+        if isinstance(image_data, bytes):
+            image = Image.open(io.BytesIO(image_data))
+        elif isinstance(image_data, str):
+            image = Image.open(image_data)
+        elif isinstance(image_data, np.ndarray):
+            image = Image.fromarray(image_data)
+        else:
+            image = image_data
+
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        original_size = image.size
+        max_pixels = self.ring.slot_bytes // 3
+        if original_size[0] * original_size[1] > max_pixels:
+            scale = math.sqrt(max_pixels / (original_size[0] * original_size[1]))
+            image = image.resize(
+                (max(int(original_size[0] * scale), 1), max(int(original_size[1] * scale), 1)),
+                Image.Resampling.BILINEAR
+            )
+
+        # ultralytics treats numpy input as BGR (OpenCV order)
+        return np.asarray(image)[..., ::-1], original_size, image.size
+
+    def submit(self, model, image_data, threshold, options=None, timeout=None):
+        """
+        Send one image to the worker
+
+        Args:
+            model: Model name on the worker
+            image_data: PIL Image, numpy array (RGB), bytes or file path
+            threshold: Confidence threshold
+            options: detect() keyword arguments (imgsz, rect, ...)
+            timeout: Seconds to wait for a free slot
+
+        Returns:
+            Future resolving to the detect() output
+        """
+        pixels, original_size, input_size = self._to_pixels(image_data)
+
+        slot = self.ring.acquire(timeout)
+        try:
+            self.ring.write(slot, pixels)
+        except Exception:
+            self.ring.release(slot)
+            raise
+
+        future = Future()
+        request_id = next(self._ids)
+        with self._pending_lock:
+            self._pending[request_id] = (future, slot, original_size, input_size)
+
+        with self._send_lock:
+            self.conn.send((
+                'detect', request_id, model, slot, pixels.shape, threshold, options or {}
+            ))
+        return future
+
+    def close(self):
+        """Close the connection and free the ring buffer"""
+        try:
+            # Closing the fd alone doesn't end the connection while the read
+            # loop is blocked in recv(); shut the socket down so the worker
+            # sees EOF (and detaches the ring) and the read loop exits
+            try:
+                with socket.fromfd(self.conn.fileno(), socket.AF_INET, socket.SOCK_STREAM) as sock:
+                    sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # Already closed
+            self.conn.close()
+        finally:
+            try:
+                self.ring.close()
+            except (BufferError, FileNotFoundError):
+                pass
+
+
+class RemoteClassifier(DetectionFormatter):
+    """
+    YOLOClassifier stand-in that runs inference on worker processes
+    """
+
+    def __init__(self, clients, model_name, threshold=0.5, timeout=120):
+        """
+        Args:
+            clients: List of WorkerClient connections that serve this model
+            model_name: Model name on the workers ('medium', 'large', ...)
+            threshold: Confidence threshold (0.0 to 1.0)
+            timeout: Seconds to wait for a result
+        """
+        self.clients = clients
+        self.model_name = model_name
+        self.threshold = threshold
+        self.timeout = timeout
+
+        details = clients[0].models[model_name]
+        self.model_size = details['model_size']
+        self.class_names = {int(k): v for k, v in details['class_names'].items()}
+        self._info = details['info']
+        self.has_embeddings = self._info.get('embeddings', False)
+
+    def _client(self):
+        """Worker with the fewest requests in flight"""
+        return min(self.clients, key=lambda client: client.num_pending)
+
+    def detect(self, image_data, **options):
+        """Run detect() on a worker; same output as YOLOClassifier.detect()"""
+        future = self._client().submit(
+            self.model_name, image_data, self.threshold, options, timeout=self.timeout
+        )
+        return future.result(self.timeout)
+
+    def detect_batch(self, images, **options):
+        """Submit all images at once so the worker can batch them"""
+        futures = [
+            self._client().submit(
+                self.model_name, image_data, self.threshold, options, timeout=self.timeout
+            )
+            for image_data in images
+        ]
+        return [future.result(self.timeout) for future in futures]
+
+    def predict(self, image_data, **options):
+        return self.format_predictions(self.detect(image_data, **options))
+
+    def predict_with_boxes(self, image_data, **options):
+        return self.format_boxes(self.detect(image_data, **options))
+
+    def predict_labels(self, image_data, **options):
+        return self.format_predictions(self.detect(image_data, labels_only=True, **options))
+
+    def set_threshold(self, new_threshold):
+        """Update confidence threshold"""
+        if 0.0 <= new_threshold <= 1.0:
+            self.threshold = new_threshold
+        else:
+            raise ValueError("Threshold must be between 0.0 and 1.0")
+
+    def get_model_info(self):
+        """Get model information (as reported by the worker)"""
+        info = dict(self._info)
+        info['threshold'] = self.threshold
+        info['backend'] = 'worker'
+        info['workers'] = len(self.clients)
+        return info
+
+
+def start_worker_process(address, models, authkey=None):
+    """
+    Start an inference worker next to the API process
+
+    Args:
+        address: (host, port) to listen on
+        models: List of model names to load
+        authkey: Shared secret (a random one is generated if not given)
+
+    Returns:
+        Tuple of (subprocess.Popen handle, terminated at exit; authkey)
+    """
+    authkey = authkey or secrets.token_hex(32).encode()
+    process = subprocess.Popen([
+        sys.executable, os.path.abspath(__file__),
+        '--address', f'{address[0]}:{address[1]}',
+        '--models', ','.join(models),
+    ], env=dict(os.environ, WORKER_AUTHKEY=authkey.decode()))
+    atexit.register(process.terminate)
+    return process, authkey
+
+
+def connect_workers(addresses, threshold=0.5, connect_timeout=0, authkey=WORKER_AUTHKEY):
+    """
+    Connect to every worker and build one RemoteClassifier per model
+
+    Args:
+        addresses: List of (host, port) worker addresses
+        threshold: Initial confidence threshold
+        connect_timeout: Seconds to keep retrying each connection
+        authkey: Shared secret of the workers
+
+    Returns:
+        Dict of model name -> RemoteClassifier
+    """
+    clients = [
+        WorkerClient(address, authkey=authkey, connect_timeout=connect_timeout)
+        for address in addresses
+    ]
+
+    classifiers = {}
+    for name in MODEL_SIZES:
+        serving = [client for client in clients if name in client.models]
+        if serving:
+            classifiers[name] = RemoteClassifier(serving, name, threshold=threshold)
+    return classifiers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a dedicated inference worker')
+    parser.add_argument('--address', default='%s:%d' % WORKER_ADDRESSES[0])
+    parser.add_argument('--models', default=','.join(MODEL_SIZES))
+    args = parser.parse_args()
+
+    from app.autotune import startup_tuning
+    from app.inference_yolo import YOLOClassifier
+
+    print("=" * 60)
+    print("Inference Worker")
+    print("=" * 60)
+
+    models = args.models.split(',')
+    tuning = startup_tuning(models)
+    batch_sizes = tuning['batch_sizes'] if tuning else {}
+
+    classifiers = {}
+    for name in models:
+        print(f"Loading YOLOv8-{name}...")
+        classifiers[name] = YOLOClassifier(
+            model_size=MODEL_SIZES[name],
+            threshold=0.5,
+            optimize=OPTIMIZED_LOAD,
+            compile_mode=COMPILE_MODE,
+            imgsz=INFERENCE_IMGSZ,
+            warmup_batch_sizes=sorted({1, batch_sizes.get(name, WORKER_MAX_BATCH)}),
+        )
+
+    server = InferenceServer(classifiers, batch_sizes=batch_sizes)
+    server.serve_forever(parse_address(args.address))
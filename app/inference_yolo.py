@@ -5,17 +5,39 @@ No training needed - model downloads automatically!
 
 from ultralytics import YOLO
 import numpy as np
+import torch
 from PIL import Image
 import io
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
 
+# Allow running this file directly (python app/inference_yolo.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-class YOLOClassifier:
+from app.config import CLASS_NAMES, COCO_TO_VOC
+from app.detections import DetectionFormatter
+from app.profiling import torch_trace
+
+
+class YOLOClassifier(DetectionFormatter):
     """
     Multi-Label Image Classifier using YOLOv8
     Pre-trained on COCO dataset (80 classes)
     """
 
-    def __init__(self, model_size='m', threshold=0.5):
+    # Largest YOLOv8 feature stride; input sides must be a multiple of it
+    STRIDE = 32
+
+    # Accepted per-request input resolutions
+    MIN_IMGSZ = 128
+    MAX_IMGSZ = 1280
+
+    def __init__(self, model_size='m', threshold=0.5, optimize=False,
+                 compile_mode=None, imgsz=640, warmup_batch_sizes=(1,)):
         """
         Initialize YOLOv8 classifier
 
@@ -23,9 +45,18 @@ class YOLOClassifier:
             model_size: 'n' (nano), 's' (small), 'm' (medium), 'l' (large), 'x' (xlarge)
                        Larger = better accuracy but slower
             threshold: Confidence threshold (0.0 to 1.0)
+            optimize: Fuse Conv+BN layers, switch to channels-last and run
+                      warm-up passes before serving the first request
+            compile_mode: None, 'torchscript' (export once, fixed input shape)
+                          or 'compile' (torch.compile the network forward)
+            imgsz: Input size used for compilation and warm-up
+            warmup_batch_sizes: Batch sizes to warm up (only with optimize)
         """
         self.threshold = threshold
         self.model_size = model_size
+        self.optimize = optimize
+        self.compile_mode = compile_mode
+        self.imgsz = imgsz
 
         # Model paths - downloads automatically if not present
         model_map = {
@@ -41,137 +72,486 @@ class YOLOClassifier:
         print(f"Loading YOLOv8 model: {model_path}")
         print("(Model will download automatically on first use)")
 
+        load_start = time.time()
+
         # Load model - downloads if needed
         self.model = YOLO(model_path)
 
         # COCO class names (80 classes)
         self.class_names = self.model.names  # Dict: {0: 'person', 1: 'bicycle', ...}
 
+        # Underlying torch network, used directly by the label-only path
+        self.network = self.model.model
+
+        # self.model(...) writes per-call arguments (classes, conf)
+        # into the shared ultralytics predictor before running it, so
+        # concurrent calls from request threads must not interleave
+        self._predict_lock = threading.Lock()
+
+        if optimize:
+            self._optimize_model(model_path)
+
+        # Pooled backbone features (embed=True) come from a hook on the
+        # last backbone layer; traced / compiled graphs can't be hooked
+        self.has_embeddings = compile_mode is None
+        self._capture = threading.local()
+        if self.has_embeddings:
+            backbone_end = len(self.network.yaml['backbone']) - 1
+            self.network.model[backbone_end].register_forward_hook(self._capture_features)
+
+        self.load_time = time.time() - load_start
+
+        # Warm-up: the first forward pass pays for allocator growth, kernel
+        # selection and (with compile_mode) tracing, so do it before serving
+        self.warmup_times = {}
+        if optimize:
+            for batch_size in warmup_batch_sizes:
+                self.warmup_times[batch_size] = self.warmup(batch_size)
+
+        self.time_to_warm = time.time() - load_start
+
         print(f"✓ Model loaded: YOLOv8-{model_size}")
         print(f"✓ Classes: {len(self.class_names)}")
-
-    def predict(self, image_data):
+        if optimize:
+            print(f"✓ Optimized ({compile_mode or 'eager'}), warm in {self.time_to_warm:.2f}s")
+
+    def _optimize_model(self, model_path):
+        """Apply layer fusion, channels-last and optional compilation"""
+        if self.compile_mode == 'torchscript':
+            # Export once next to the weights, then serve the traced graph
+            script_path = os.path.splitext(model_path)[0] + '.torchscript'
+            if not os.path.exists(script_path):
+                script_path = self.model.export(format='torchscript', imgsz=self.imgsz)
+            self.model = YOLO(script_path, task='detect')
+            self.network = torch.jit.load(script_path)
+            return
+
+        # Merge BatchNorm into the preceding convolutions
+        self.model.fuse()
+
+        network = self.model.model
+        network.eval()
+        network.to(memory_format=torch.channels_last)
+
+        if self.compile_mode == 'compile':
+            # Compile the forward only so ultralytics still sees the
+            # original module (stride, names, fuse(), ...). imgsz / rect
+            # vary per request, so the graph is compiled for symbolic shapes
+            # instead of recompiling (and eventually falling back to
+            # eager) for every new input shape
+            network.forward = torch.compile(network.forward, dynamic=True)
+
+    def warmup(self, batch_size=1):
         """
-        Make predictions on an image
+        Run forward passes on blank images of the shapes served
+
+        Besides the square input, landscape and portrait (4:3) rect inputs
+        are run. TorchScript graphs take the square input only.
 
         Args:
-            image_data: Can be:
-                - PIL Image
-                - numpy array
-                - bytes
-                - file path (string)
+            batch_size: Number of images in the warm-up batch
 
         Returns:
-            Dictionary with prediction results
+            Seconds taken by the passes
         """
-        # Convert bytes to PIL if needed
-        if isinstance(image_data, bytes):
-            image = Image.open(io.BytesIO(image_data))
-        else:
-            image = image_data
-
-        # Run inference
-        results = self.model(image, conf=self.threshold, verbose=False)
+        short_side = self.imgsz * 3 // 4
+        shapes = [(self.imgsz, self.imgsz)]
+        if self.compile_mode != 'torchscript':
+            shapes += [(short_side, self.imgsz), (self.imgsz, short_side)]
 
-        # Extract predictions
-        detected_objects = []
-        all_predictions = {}
-        binary_predictions = {}
+        start = time.time()
+        for height, width in shapes:
+            blank = np.zeros((height, width, 3), dtype=np.uint8)
+            self.detect_batch([blank] * batch_size, rect=height != width)
+        return time.time() - start
 
-        # Initialize all classes as 0
-        for class_id, class_name in self.class_names.items():
-            all_predictions[class_name] = 0.0
-            binary_predictions[class_name] = 0
+    def release_inputs(self):
+        """
+        Drop the ultralytics predictor's references to the last batch
 
-        # Process detections
-        for result in results:
-            boxes = result.boxes
+        The predictor keeps the last input batch and results (which hold the
+        original images) until the next call; for shared-memory views that
+        would keep the segment from being unmapped.
+        """
+        predictor = getattr(self.model, 'predictor', None)
+        if predictor is not None:
+            with self._predict_lock:
+                predictor.batch = None
+                predictor.results = None
+
+    def _capture_features(self, module, inputs, output):
+        """Forward hook: keep the pooled output if this thread asked for it"""
+        captured = getattr(self._capture, 'features', None)
+        if captured is not None:
+            captured.append(output.float().mean(dim=(2, 3)))
+
+    @contextmanager
+    def _embedding_capture(self, enabled):
+        """Collect pooled backbone features of the forward passes in the block"""
+        if not enabled:
+            yield None
+            return
+        if not self.has_embeddings:
+            raise ValueError(f"Embeddings need an eager model (compile_mode is '{self.compile_mode}')")
+
+        captured = []
+        self._capture.features = captured
+        try:
+            yield captured
+        finally:
+            self._capture.features = None
+
+    @staticmethod
+    def _embeddings(captured, count):
+        """(count, C) L2-normalised float32 array from captured features"""
+        # Keep the last `count` rows: ultralytics may run its own warm-up
+        # pass before the first real batch
+        features = torch.cat(captured)[-count:]
+        return torch.nn.functional.normalize(features, dim=1).cpu().numpy()
+
+    def _load_image(self, image_data):
+        """Convert bytes to a PIL image, pass anything else through"""
+        if isinstance(image_data, bytes):
+            return Image.open(io.BytesIO(image_data))
+        return image_data
 
-            for box in boxes:
-                class_id = int(box.cls[0])
-                confidence = float(box.conf[0])
-                class_name = self.class_names[class_id]
-
-                # Update with highest confidence for each class
-                if confidence > all_predictions[class_name]:
-                    all_predictions[class_name] = confidence
-
-                # Add to detected objects if not already there
-                if class_name not in detected_objects:
-                    detected_objects.append(class_name)
-                    binary_predictions[class_name] = 1
-
-        # Sort all_predictions for better display
-        all_predictions = dict(sorted(
-            all_predictions.items(),
-            key=lambda x: x[1],
-            reverse=True
-        ))
+    def resolve_imgsz(self, imgsz=None, rect=False, sizes=()):
+        """
+        Work out the network input size for a request
 
-        return {
-            'detected_objects': detected_objects,
-            'all_predictions': all_predictions,
-            'binary_predictions': binary_predictions,
-            'threshold': self.threshold,
-            'num_detected': len(detected_objects),
-            'model_trained': True,  # Pre-trained model
-            'model_info': f'YOLOv8-{self.model_size}',
-        }
+        Args:
+            imgsz: Longest input side in pixels (defaults to self.imgsz)
+            rect: Letterbox to the image aspect ratio (padded only up to a
+                  multiple of the stride) instead of a full square
+            sizes: (width, height) of every image in the batch
 
-    def predict_with_boxes(self, image_data):
+        Returns:
+            (height, width) of the letterboxed network input
         """
-        Make predictions with bounding boxes
+        imgsz = int(imgsz or self.imgsz)
+        if imgsz % self.STRIDE or not self.MIN_IMGSZ <= imgsz <= self.MAX_IMGSZ:
+            raise ValueError(
+                f"imgsz must be a multiple of {self.STRIDE} between "
+                f"{self.MIN_IMGSZ} and {self.MAX_IMGSZ}"
+            )
+        if self.compile_mode == 'torchscript' and (imgsz != self.imgsz or rect):
+            raise ValueError(
+                f"TorchScript model is compiled for a fixed {self.imgsz}x{self.imgsz} input"
+            )
+
+        if not rect or not sizes:
+            return (imgsz, imgsz)
+
+        # Scale the longest side to imgsz, round each side up to the stride;
+        # a batch shares one shape, so take the largest of each side
+        shape_h, shape_w = 0, 0
+        for width, height in sizes:
+            ratio = imgsz / max(width, height)
+            shape_h = max(shape_h, math.ceil(height * ratio / self.STRIDE) * self.STRIDE)
+            shape_w = max(shape_w, math.ceil(width * ratio / self.STRIDE) * self.STRIDE)
+        return (shape_h, shape_w)
+
+    def resolve_classes(self, classes=None, label_set='coco'):
+        """
+        Work out which classes a request scores and what they are called
+
+        Args:
+            classes: Optional list of class names to keep (in the naming of
+                     `label_set`)
+            label_set: 'coco' (80 classes) or 'voc' (the 20 PASCAL VOC
+                       classes, projected from their COCO equivalents)
 
-        Returns predictions plus bounding box coordinates
+        Returns:
+            Tuple of (list of COCO class ids to pass to the model, or None
+            for all classes; dict of class id -> reported name)
         """
-        if isinstance(image_data, bytes):
-            image = Image.open(io.BytesIO(image_data))
+        if label_set == 'voc':
+            names = {
+                class_id: COCO_TO_VOC[name]
+                for class_id, name in self.class_names.items() if name in COCO_TO_VOC
+            }
+            # Report in the PASCAL VOC order of CLASS_NAMES
+            names = dict(sorted(names.items(), key=lambda item: CLASS_NAMES.index(item[1])))
+        elif label_set == 'coco':
+            names = dict(self.class_names)
         else:
-            image = image_data
+            raise ValueError("label_set must be 'coco' or 'voc'")
 
-        # Get image dimensions
-        width, height = image.size
+        if classes:
+            unknown = sorted(set(classes) - set(names.values()))
+            if unknown:
+                raise ValueError(f"Unknown classes for label_set '{label_set}': {', '.join(unknown)}")
+            names = {class_id: name for class_id, name in names.items() if name in classes}
 
-        results = self.model(image, conf=self.threshold, verbose=False)
+        if label_set == 'coco' and not classes:
+            return None, names
+        return list(names), names
 
-        detections = []
+    def detect(self, image_data, **options):
+        """
+        Run the detector once and return the raw detections
 
-        for result in results:
-            boxes = result.boxes
+        Args:
+            image_data: PIL Image, numpy array, bytes or file path
+            **options: imgsz, rect, labels_only, classes, label_set, embed
+                       (see detect_batch)
 
-            for box in boxes:
-                class_id = int(box.cls[0])
-                confidence = float(box.conf[0])
-                class_name = self.class_names[class_id]
+        Returns:
+            Dictionary with 'detections' (class, confidence, box),
+            'width', 'height', 'input_size' and 'inference_time'
+        """
+        return self.detect_batch([image_data], **options)[0]
 
-                # Get bounding box coordinates [x1, y1, x2, y2]
-                bbox = box.xyxy[0].tolist()
+    def detect_batch(self, images, imgsz=None, rect=False, labels_only=False,
+                     classes=None, label_set='coco', embed=False):
+        """
+        Run the detector on several images in one forward pass
 
+        Args:
+            images: List of PIL Images, numpy arrays, bytes or file paths
+            imgsz: Input resolution (longest side); defaults to self.imgsz
+            rect: Rectangular letterbox instead of a full square
+            labels_only: Return per-class scores only (see detect_labels_batch)
+            classes: Only score these class names; the filter is applied
+                     inside the model call, before NMS
+            label_set: 'coco' or 'voc' (see resolve_classes)
+            embed: Also return 'embedding', the globally average-pooled
+                   output of the last backbone layer (L2-normalised
+                   float32 vector), taken from the same forward pass
+
+        Returns:
+            List of detect() outputs, in input order. 'inference_time' is
+            the batch time divided evenly between the images. 'classes'
+            lists the reported class names when filtered or projected.
+        """
+        if labels_only:
+            return self.detect_labels_batch(
+                images, imgsz=imgsz, rect=rect, classes=classes, label_set=label_set,
+                embed=embed
+            )
+
+        class_ids, names = self.resolve_classes(classes, label_set)
+
+        images = [self._to_rgb(self._load_image(image_data)) for image_data in images]
+        sizes = [image.size for image in images]
+        input_size = self.resolve_imgsz(imgsz, rect, sizes if rect else ())
+
+        start = time.time()
+        # Letterboxed here rather than by the ultralytics predictor, whose
+        # padding (only up to the stride) depends on the version and batch;
+        # a tensor input runs at exactly input_size, as the label-only path
+        batch, placements = self._letterbox(images, input_size)
+        with torch.inference_mode(), torch_trace.record(), self._embedding_capture(embed) as captured, \
+                self._predict_lock:
+            results = self.model(batch, conf=self.threshold, classes=class_ids, verbose=False)
+        inference_time = (time.time() - start) / max(len(images), 1)
+        embeddings = self._embeddings(captured, len(images)) if embed else None
+
+        outputs = []
+
+        for index, (result, (width, height), (ratio, left, top)) in enumerate(
+                zip(results, sizes, placements)):
+            # Boxes come back in letterboxed input coordinates
+            detections = []
+            for box in result.boxes:
+                class_id = int(box.cls[0])
+                x1, y1, x2, y2 = box.xyxy[0].tolist()
                 detections.append({
-                    'class': class_name,
-                    'confidence': confidence,
-                    'box': bbox  # [x1, y1, x2, y2]
+                    'class': names[class_id],
+                    'confidence': float(box.conf[0]),
+                    'box': [  # [x1, y1, x2, y2]
+                        min(max((x1 - left) / ratio, 0.0), width),
+                        min(max((y1 - top) / ratio, 0.0), height),
+                        min(max((x2 - left) / ratio, 0.0), width),
+                        min(max((y2 - top) / ratio, 0.0), height),
+                    ]
                 })
 
-        # Get unique detected objects
-        detected_objects = list(set([d['class'] for d in detections]))
+            outputs.append({
+                'detections': detections,
+                'classes': list(names.values()) if class_ids is not None else None,
+                'width': width,
+                'height': height,
+                'input_size': list(input_size),  # [height, width]
+                'inference_time': inference_time,
+            })
+            if embed:
+                outputs[-1]['embedding'] = embeddings[index]
+
+        return outputs
+
+    def detect_labels_batch(self, images, imgsz=None, rect=False, classes=None,
+                            label_set='coco', embed=False):
+        """
+        Label-only inference: per-class presence scores without boxes
+
+        Runs the backbone, neck and only the classification branch of the
+        detection head, then max-pools each class score over every anchor
+        of every feature level. Box regression, DFL decoding, NMS and the
+        ultralytics Results objects are skipped entirely. The pooled score
+        is the best confidence any anchor gives the class, i.e. what the
+        detector would report for it before NMS.
+
+        Args:
+            images: List of PIL Images, numpy arrays (BGR), bytes or file paths
+            imgsz: Input resolution (longest side); defaults to self.imgsz
+            rect: Rectangular letterbox instead of a full square
+            classes: Only score these class names
+            label_set: 'coco' or 'voc' (see resolve_classes)
+            embed: Also return 'embedding' (see detect_batch)
+
+        Returns:
+            List of dictionaries with 'detections' (None), 'scores' (every
+            reported class -> score), 'classes', 'width', 'height',
+            'input_size' and 'inference_time'
+        """
+        class_ids, names = self.resolve_classes(classes, label_set)
+        if class_ids is None:
+            class_ids = list(names)
+
+        images = [self._to_rgb(self._load_image(image_data)) for image_data in images]
+        sizes = [image.size for image in images]
+        input_size = self.resolve_imgsz(imgsz, rect, sizes if rect else ())
 
-        # Calculate inference time (approximate)
-        import time
         start = time.time()
-        _ = self.model(image, conf=self.threshold, verbose=False)
-        inference_time = time.time() - start
+        batch, _ = self._letterbox(images, input_size)
+        with torch.inference_mode(), torch_trace.record(), self._embedding_capture(embed) as captured:
+            scores = self._class_scores(batch)[:, class_ids]
+        inference_time = (time.time() - start) / max(len(images), 1)
+        embeddings = self._embeddings(captured, len(images)) if embed else None
+
+        outputs = []
+        for index, ((width, height), image_scores) in enumerate(zip(sizes, scores.tolist())):
+            outputs.append({
+                'detections': None,
+                'scores': {
+                    names[class_id]: score
+                    for class_id, score in zip(class_ids, image_scores)
+                },
+                'classes': list(names.values()),
+                'width': width,
+                'height': height,
+                'input_size': list(input_size),  # [height, width]
+                'inference_time': inference_time,
+            })
+            if embed:
+                outputs[-1]['embedding'] = embeddings[index]
+
+        return outputs
+
+    @staticmethod
+    def _to_rgb(image):
+        """PIL RGB image from a PIL image, BGR numpy array or file path"""
+        if isinstance(image, str):
+            image = Image.open(image)
+        elif isinstance(image, np.ndarray):
+            # Same convention as ultralytics: numpy input is BGR
+            image = Image.fromarray(np.ascontiguousarray(image[..., ::-1]))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image
+
+    def _letterbox(self, images, input_size):
+        """
+        Resize-and-pad images into one NCHW float tensor (gray padding)
 
-        return {
-            'detections': detections,
-            'detected_objects': detected_objects,
-            'num_detected': len(detections),
-            'threshold': self.threshold,
-            'model_info': f'YOLOv8-{self.model_size}',
-            'width': width,
-            'height': height,
-            'inference_time': inference_time
-        }
+        Returns:
+            Tuple of (tensor, list of (scale, left pad, top pad) per image)
+        """
+        shape_h, shape_w = input_size
+        batch = np.full((len(images), shape_h, shape_w, 3), 114, dtype=np.uint8)
+        placements = []
+
+        for i, image in enumerate(images):
+            ratio = min(shape_h / image.height, shape_w / image.width)
+            new_w = max(round(image.width * ratio), 1)
+            new_h = max(round(image.height * ratio), 1)
+            top = (shape_h - new_h) // 2
+            left = (shape_w - new_w) // 2
+            batch[i, top:top + new_h, left:left + new_w] = np.asarray(
+                image.resize((new_w, new_h), Image.Resampling.BILINEAR)
+            )
+            placements.append((ratio, left, top))
+
+        tensor = torch.from_numpy(batch).permute(0, 3, 1, 2).float().div_(255.0)
+        if self.optimize:
+            tensor = tensor.contiguous(memory_format=torch.channels_last)
+        return tensor, placements
+
+    def _class_scores(self, batch):
+        """(B, num_classes) max class probability over all anchors"""
+        network = self.network
+
+        if isinstance(network, torch.jit.ScriptModule):
+            # Traced graphs can't be cut open: pool the full head output
+            output = network(batch)
+            output = output[0] if isinstance(output, (list, tuple)) else output
+            return output[:, 4:, :].amax(dim=2)
+
+        # Same walk as DetectionModel._predict_once, stopping at the head
+        outputs = []
+        x = batch
+        for layer in network.model[:-1]:
+            if layer.f != -1:
+                x = outputs[layer.f] if isinstance(layer.f, int) else [
+                    x if j == -1 else outputs[j] for j in layer.f
+                ]
+            x = layer(x)
+            outputs.append(x if layer.i in network.save else None)
+
+        head = network.model[-1]
+        features = [x if j == -1 else outputs[j] for j in head.f]
+
+        # Classification branch only (cv3); sigmoid is monotonic, so pool
+        # the logits first and squash the (B, num_classes) result
+        logits = torch.stack([
+            head.cv3[level](features[level]).amax(dim=(2, 3))
+            for level in range(head.nl)
+        ])
+        return logits.amax(dim=0).sigmoid()
+
+    def predict_labels(self, image_data, **options):
+        """
+        Multi-label prediction without boxes (fast path)
+
+        Same response schema as predict(); 'all_predictions' holds the
+        pooled score of every class.
+        """
+        return self.format_predictions(self.detect(image_data, labels_only=True, **options))
+
+    def predict(self, image_data, imgsz=None, rect=False, classes=None, label_set='coco'):
+        """
+        Make predictions on an image
+
+        Args:
+            image_data: Can be:
+                - PIL Image
+                - numpy array
+                - bytes
+                - file path (string)
+            imgsz: Input resolution (e.g. 320, 480, 640, 960)
+            rect: Rectangular letterbox instead of a full square
+            classes: Only score these class names (e.g. ['dog', 'person'])
+            label_set: 'coco' (80 classes) or 'voc' (20 PASCAL VOC classes)
+
+        Returns:
+            Dictionary with prediction results
+        """
+        return self.format_predictions(self.detect(
+            image_data, imgsz=imgsz, rect=rect, classes=classes, label_set=label_set
+        ))
+
+    def predict_with_boxes(self, image_data, imgsz=None, rect=False, classes=None,
+                           label_set='coco'):
+        """
+        Make predictions with bounding boxes
+
+        Returns predictions plus bounding box coordinates (in the original
+        image's pixel space, whatever the input resolution)
+        """
+        return self.format_boxes(self.detect(
+            image_data, imgsz=imgsz, rect=rect, classes=classes, label_set=label_set
+        ))
 
     def set_threshold(self, new_threshold):
         """Update confidence threshold"""
@@ -191,6 +571,12 @@ class YOLOClassifier:
             "class_names": list(self.class_names.values()),
             "threshold": self.threshold,
             "pretrained_on": "COCO dataset",
+            "optimized": self.optimize,
+            "compile_mode": self.compile_mode,
+            "load_time": self.load_time,
+            "warmup_times": self.warmup_times,
+            "time_to_warm": self.time_to_warm,
+            "embeddings": self.has_embeddings,
         }
 
 
@@ -0,0 +1,323 @@
+"""
+Persistent label index for past detections
+
+Every processed image is recorded once per model (content hash, image size,
+per-class max confidence and boxes) in a local SQLite database. Records
+are keyed by a composite model key (e.g. 'medium@320r' or 'medium/labels')
+for cache lookups; searches filter on the base model name, stored in its
+own indexed column. The
+`labels` table holds one posting per (label, image), indexed by
+(label, image_id) and counted per label in `label_counts`. A multi-label
+query walks the posting list of its rarest label newest-first, probes the
+other labels of each candidate through the index and stops as soon as
+`limit` matches are found, so it never builds the full match set.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+def hash_image(image_data):
+    """
+    Content hash used as the image key
+
+    Args:
+        image_data: Raw image bytes
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def base_model_name(model_key):
+    """Model name of a composite index key ('medium@320r:voc' -> 'medium')"""
+    return re.split(r'[@:\[/]', model_key, maxsplit=1)[0]
+
+
+class LabelIndex:
+    """
+    Local store of processed images with per-class inverted indexes
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY,
+            image_hash TEXT NOT NULL,
+            model TEXT NOT NULL,
+            base_model TEXT,
+            threshold REAL NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            scores TEXT NOT NULL,
+            detections TEXT,
+            classes TEXT,
+            created REAL NOT NULL,
+            UNIQUE (image_hash, model)
+        );
+        CREATE TABLE IF NOT EXISTS labels (
+            label TEXT NOT NULL,
+            confidence REAL NOT NULL,
+            image_id INTEGER NOT NULL,
+            PRIMARY KEY (label, confidence, image_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS labels_image ON labels (image_id);
+        CREATE INDEX IF NOT EXISTS labels_label_image ON labels (label, image_id, confidence);
+        CREATE TABLE IF NOT EXISTS label_counts (
+            label TEXT PRIMARY KEY,
+            postings INTEGER NOT NULL
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_path):
+        """
+        Open (or create) the index
+
+        Args:
+            db_path: Path to the SQLite database file
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        # One connection shared by all request threads, serialised by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        new_counts = not self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'label_counts'"
+        ).fetchone()
+        self._conn.executescript(self.SCHEMA)
+
+        # Databases created before class filtering lack the classes column
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(images)')]
+        if 'classes' not in columns:
+            self._conn.execute('ALTER TABLE images ADD COLUMN classes TEXT')
+        # ... and before searches filtered on the base model name
+        if 'base_model' not in columns:
+            self._conn.execute('ALTER TABLE images ADD COLUMN base_model TEXT')
+            keys = self._conn.execute('SELECT DISTINCT model FROM images').fetchall()
+            self._conn.executemany(
+                'UPDATE images SET base_model = ? WHERE model = ?',
+                [(base_model_name(key), key) for key, in keys]
+            )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS images_base_model ON images (base_model)'
+        )
+        # Databases created before the per-label counts need them filled in
+        if new_counts:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO label_counts (label, postings) '
+                'SELECT label, COUNT(*) FROM labels GROUP BY label'
+            )
+        self._conn.commit()
+
+    def add(self, image_hash, model, threshold, detected, scores=None, base_model=None):
+        """
+        Record the result of one inference
+
+        Args:
+            image_hash: Content hash from hash_image()
+            model: Model key ('medium', or a composite key such as
+                   'medium@320r' for results of non-default options)
+            threshold: Confidence threshold the detections were produced at
+            detected: Output of YOLOClassifier.detect(), or None when only
+                      per-class scores are available
+            scores: Per-class scores (stored in full; classes at or above
+                    the threshold go into the posting lists); derived from
+                    the detections when omitted
+            base_model: Model name searches filter on; parsed from `model`
+                        when omitted
+        """
+        detections = detected['detections'] if detected else None
+
+        if scores is None:
+            scores = {}
+            for detection in detections or []:
+                class_name = detection['class']
+                scores[class_name] = max(scores.get(class_name, 0.0), detection['confidence'])
+
+        # Only classes that were actually seen go into the posting lists
+        postings = {
+            label: conf for label, conf in scores.items() if conf > 0.0 and conf >= threshold
+        }
+
+        with self._lock, self._conn:
+            old_labels = self._conn.execute(
+                'SELECT label FROM labels WHERE image_id IN '
+                '(SELECT id FROM images WHERE image_hash = ? AND model = ?)',
+                (image_hash, model)
+            ).fetchall()
+            self._conn.executemany(
+                'UPDATE label_counts SET postings = postings - 1 WHERE label = ?', old_labels
+            )
+            self._conn.execute(
+                'DELETE FROM labels WHERE image_id IN '
+                '(SELECT id FROM images WHERE image_hash = ? AND model = ?)',
+                (image_hash, model)
+            )
+            cursor = self._conn.execute(
+                'INSERT OR REPLACE INTO images '
+                '(image_hash, model, base_model, threshold, width, height, scores, detections, '
+                'classes, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    image_hash, model, base_model or base_model_name(model), threshold,
+                    detected['width'] if detected else None,
+                    detected['height'] if detected else None,
+                    json.dumps(scores),
+                    json.dumps(detections) if detections is not None else None,
+                    json.dumps(detected['classes']) if detected and detected.get('classes') else None,
+                    time.time(),
+                )
+            )
+            image_id = cursor.lastrowid
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO labels (label, confidence, image_id) VALUES (?, ?, ?)',
+                [(label, conf, image_id) for label, conf in postings.items()]
+            )
+            self._conn.executemany(
+                'INSERT INTO label_counts (label, postings) VALUES (?, 1) '
+                'ON CONFLICT (label) DO UPDATE SET postings = postings + 1',
+                [(label,) for label in postings]
+            )
+
+    def lookup(self, image_hash, model, threshold, need_boxes=False):
+        """
+        Answer a repeated request from the index
+
+        A stored result can serve any threshold at or above the one it was
+        produced at: detections below the new threshold are dropped.
+
+        Args:
+            image_hash: Content hash from hash_image()
+            model: Model key, as passed to add()
+            threshold: Requested confidence threshold
+            need_boxes: Only return records that kept their boxes
+
+        Returns:
+            Dictionary shaped like YOLOClassifier.detect() output (plus
+            'scores'), or None on a miss
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT threshold, width, height, scores, detections, classes '
+                'FROM images WHERE image_hash = ? AND model = ?',
+                (image_hash, model)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        stored_threshold, width, height, scores, detections, classes = row
+        if threshold < stored_threshold:
+            return None
+        if need_boxes and detections is None:
+            return None
+
+        # Label-only records return every score, like a fresh reply
+        scores = json.loads(scores)
+        if detections is not None:
+            scores = {label: conf for label, conf in scores.items() if conf >= threshold}
+            detections = [
+                d for d in json.loads(detections)
+                if d['confidence'] >= threshold
+            ]
+
+        return {
+            'detections': detections,
+            'scores': scores,
+            'classes': json.loads(classes) if classes else None,
+            'width': width,
+            'height': height,
+            'inference_time': 0.0,
+        }
+
+    def search(self, labels, min_conf=0.5, model=None, limit=100):
+        """
+        Find images that contain every requested label
+
+        Args:
+            labels: List of class names (all must be present)
+            min_conf: Minimum per-class confidence
+            model: Restrict to results from one model ('medium', 'large',
+                   ...), whatever options they were produced with
+            limit: Maximum number of images to return
+
+        Returns:
+            List of dictionaries with image_hash, model (base name), width,
+            height, created (time indexed) and the scores of the requested
+            labels, newest first, one per image and model
+        """
+        if not labels:
+            return []
+        labels = list(dict.fromkeys(labels))
+
+        with self._lock:
+            counts = dict(self._conn.execute(
+                f"SELECT label, postings FROM label_counts WHERE label IN ({','.join('?' * len(labels))})",
+                labels
+            ).fetchall())
+            if len(counts) < len(labels) or not all(counts.values()):
+                return []  # Some label was never seen
+
+            # Walk the rarest posting list newest-first; the other labels
+            # are index probes on (label, image_id)
+            driver, *others = sorted(labels, key=lambda label: counts[label])
+            query = (
+                'SELECT images.image_hash, images.base_model, images.width, images.height, '
+                'images.scores, images.created '
+                'FROM labels INDEXED BY labels_label_image '
+                'JOIN images ON images.id = labels.image_id '
+                'WHERE labels.label = ? AND labels.confidence >= ?'
+            )
+            params = [driver, min_conf]
+            for label in others:
+                query += (
+                    ' AND EXISTS (SELECT 1 FROM labels AS other INDEXED BY labels_label_image '
+                    'WHERE other.label = ? AND other.image_id = labels.image_id '
+                    'AND other.confidence >= ?)'
+                )
+                params.extend([label, min_conf])
+            if model:
+                query += ' AND images.base_model = ?'
+                params.append(model)
+            query += ' ORDER BY labels.image_id DESC LIMIT ?'
+            params.append(int(limit))
+
+            rows = self._conn.execute(query, params).fetchall()
+
+        matches = []
+        seen = set()
+        for image_hash, model_name, width, height, scores, created in rows:
+            # Results of one model under several options count once
+            if (image_hash, model_name) in seen:
+                continue
+            seen.add((image_hash, model_name))
+            scores = json.loads(scores)
+            matches.append({
+                'image_hash': image_hash,
+                'model': model_name,
+                'width': width,
+                'height': height,
+                'created': created,
+                'scores': {label: scores.get(label, 0.0) for label in labels},
+            })
+        return matches
+
+    def stats(self):
+        """Number of indexed images and label postings"""
+        with self._lock:
+            num_images = self._conn.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+            num_labels = self._conn.execute('SELECT COUNT(*) FROM labels').fetchone()[0]
+        return {'images': num_images, 'postings': num_labels}
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,271 @@
+"""
+Online latency estimates for deadline-aware model selection
+
+Keeps, per model and request bucket (image megapixels, input resolution,
+label-only or full detection), an exponentially weighted moving average
+of inference latency and of its mean deviation - the estimator TCP uses
+for round-trip times - plus the number of requests running on each model.
+
+A request with a deadline goes to the most accurate model whose predicted
+latency fits: the work already running on that model (queue wait) plus
+mean + k * deviation for the request itself.
+
+A model that has not run a request of the bucket yet gets a prior: the
+estimate of a measured neighbour scaled by how much slower or faster the
+model is (the ratio of the two models' means in buckets both have run,
+else their relative_cost). A model with no prior at all is probed once
+when the chosen model would leave at least half the deadline unused.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds (in megapixels) of the image-size buckets
+MEGAPIXEL_BUCKETS = (0.5, 2, 8)
+
+
+class DeadlineError(Exception):
+    """No model is expected to answer within the requested deadline"""
+
+    def __init__(self, deadline_ms, predicted_ms):
+        """
+        Args:
+            deadline_ms: The requested deadline
+            predicted_ms: Dict of model -> predicted latency in ms
+        """
+        self.deadline_ms = deadline_ms
+        self.predicted_ms = predicted_ms
+        super().__init__(f'No model is expected to finish within {deadline_ms:g} ms')
+
+
+def size_bucket(width, height, options=None):
+    """
+    Bucket of requests expected to take about as long
+
+    Args:
+        width, height: Image size in pixels
+        options: Per-request inference options (imgsz, rect, labels_only)
+
+    Returns:
+        Bucket name, e.g. '<2MP/640' or '<0.5MP/320/rect/labels'
+    """
+    options = options or {}
+    megapixels = width * height / 1e6
+    size = next(
+        (f'<{bound}MP' for bound in MEGAPIXEL_BUCKETS if megapixels < bound),
+        f'>={MEGAPIXEL_BUCKETS[-1]}MP'
+    )
+
+    parts = [size, str(options.get('imgsz') or 'default')]
+    if options.get('rect'):
+        parts.append('rect')
+    if options.get('labels_only'):
+        parts.append('labels')
+    return '/'.join(parts)
+
+
+class LatencyEstimator:
+    """
+    Per-model, per-bucket latency estimates and in-flight counts
+    """
+
+    def __init__(self, alpha=0.125, beta=0.25, deviations=2.0, relative_cost=None,
+                 probe_slack=0.5, probe_interval=30.0):
+        """
+        Args:
+            alpha: EWMA weight of a new latency sample
+            beta: EWMA weight of a new deviation sample
+            deviations: Mean deviations added to the mean for a prediction
+                        (higher = fewer missed deadlines, smaller models)
+            relative_cost: Dict of model -> relative inference cost (e.g.
+                           GFLOPs), used to scale priors until two models
+                           share a measured bucket
+            probe_slack: An unmeasured model is probed only when the chosen
+                         model is predicted to use at most this fraction
+                         of the deadline
+            probe_interval: Seconds before a probe that never reported back
+                            is retried
+        """
+        self.alpha = alpha
+        self.beta = beta
+        self.deviations = deviations
+        self.relative_cost = relative_cost or {}
+        self.probe_slack = probe_slack
+        self.probe_interval = probe_interval
+        self._estimates = {}  # (model, bucket) -> [mean, deviation, samples]
+        self._in_flight = {}  # model -> requests currently running on it
+        self._probes = {}  # (model, bucket) -> time the last probe started
+        self._lock = threading.Lock()
+
+    def observe(self, model, bucket, seconds):
+        """Record the latency of one inference"""
+        with self._lock:
+            entry = self._estimates.get((model, bucket))
+            if entry is None:
+                self._estimates[(model, bucket)] = [seconds, seconds / 2, 1]
+                self._probes.pop((model, bucket), None)
+                return
+
+            mean, deviation, samples = entry
+            deviation = (1 - self.beta) * deviation + self.beta * abs(seconds - mean)
+            mean = (1 - self.alpha) * mean + self.alpha * seconds
+            entry[:] = [mean, deviation, samples + 1]
+
+    @contextmanager
+    def track(self, model):
+        """Count a request as running on `model` for the duration of the block"""
+        with self._lock:
+            self._in_flight[model] = self._in_flight.get(model, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight[model] -= 1
+
+    def predict(self, model, bucket):
+        """
+        Predicted latency of a new request, including queue wait
+
+        Returns:
+            Seconds, or None if the model has not run a request of this
+            bucket yet
+        """
+        with self._lock:
+            entry = self._estimates.get((model, bucket))
+            if entry is None:
+                return None
+            mean, deviation, _ = entry
+            waiting = self._in_flight.get(model, 0)
+
+        # Requests already running on the model are served first
+        return waiting * mean + mean + self.deviations * deviation
+
+    def _ratio(self, model, neighbour):
+        """
+        How many times slower `model` is than `neighbour` (caller holds the lock)
+
+        Returns:
+            Mean of the per-bucket ratios where both models have run, else
+            the ratio of their relative costs, else None
+        """
+        ratios = [
+            entry[0] / self._estimates[(neighbour, bucket)][0]
+            for (name, bucket), entry in self._estimates.items()
+            if name == model and (neighbour, bucket) in self._estimates
+        ]
+        if ratios:
+            return sum(ratios) / len(ratios)
+        if model in self.relative_cost and neighbour in self.relative_cost:
+            return self.relative_cost[model] / self.relative_cost[neighbour]
+        return None
+
+    def prior(self, model, neighbours):
+        """
+        Predicted latency of a model that has not run this bucket yet
+
+        Args:
+            model: Model without an estimate for the request's bucket
+            neighbours: (model, bucket) pairs to scale from, nearest first
+
+        Returns:
+            Seconds including queue wait, or None if no neighbour is
+            measured or none can be scaled to `model`
+        """
+        with self._lock:
+            for neighbour, neighbour_bucket in neighbours:
+                entry = self._estimates.get((neighbour, neighbour_bucket))
+                ratio = self._ratio(model, neighbour) if entry is not None else None
+                if ratio is not None:
+                    break
+            else:
+                return None
+            mean, deviation = entry[0] * ratio, entry[1] * ratio
+            waiting = self._in_flight.get(model, 0)
+
+        return waiting * mean + mean + self.deviations * deviation
+
+    def _start_probe(self, model, bucket):
+        """Claim the one-off probe of an unmeasured model, False if one is running"""
+        now = time.monotonic()
+        with self._lock:
+            started = self._probes.get((model, bucket))
+            if started is not None and now - started < self.probe_interval:
+                return False
+            self._probes[(model, bucket)] = now
+            return True
+
+    def choose(self, models, buckets, deadline):
+        """
+        Pick the most accurate model expected to finish in time
+
+        Unmeasured models are judged by their prior(). One without a prior
+        is probed (once per bucket) if it ranks above the chosen model and
+        that model leaves enough slack. If no predicted model fits, the
+        cheapest unmeasured model ranked below all of them is run to learn
+        its latency.
+
+        Args:
+            models: Candidate model names, most accurate first
+            buckets: Dict of model -> size_bucket() of the request as that
+                     model would run it
+            deadline: Latency budget in seconds
+
+        Returns:
+            Tuple of (model name, predicted seconds or None for a probe)
+
+        Raises:
+            DeadlineError if every predicted model is too slow and no
+            unmeasured model is left to try
+        """
+        predictions = {model: self.predict(model, buckets[model]) for model in models}
+        for index, model in enumerate(models):
+            if predictions[model] is None:
+                others = sorted(
+                    (other for other in models if predictions[other] is not None),
+                    key=lambda other: abs(models.index(other) - index)
+                )
+                predictions[model] = self.prior(
+                    model, [(other, buckets[other]) for other in others]
+                )
+
+        unknown = [model for model in models if predictions[model] is None]
+        chosen = next(
+            (model for model in models
+             if predictions[model] is not None and predictions[model] <= deadline),
+            None
+        )
+
+        if chosen is not None:
+            if predictions[chosen] <= deadline * self.probe_slack:
+                better = models[:models.index(chosen)]
+                for model in unknown:
+                    if model in better and self._start_probe(model, buckets[model]):
+                        return model, None
+            return chosen, predictions[chosen]
+
+        # Nothing predicted fits: only an unmeasured model cheaper than every
+        # predicted one can be expected to do better
+        predicted = [index for index, model in enumerate(models) if predictions[model] is not None]
+        cheaper = models[max(predicted, default=-1) + 1:]
+        if cheaper:
+            self._start_probe(cheaper[-1], buckets[cheaper[-1]])
+            return cheaper[-1], None
+
+        raise DeadlineError(deadline * 1000, {
+            model: round(predicted * 1000, 1) if predicted is not None else None
+            for model, predicted in predictions.items()
+        })
+
+    def stats(self):
+        """Current estimates in milliseconds, per model and bucket"""
+        with self._lock:
+            estimates = {}
+            for (model, bucket), (mean, deviation, samples) in sorted(self._estimates.items()):
+                estimates.setdefault(model, {})[bucket] = {
+                    'mean_ms': round(mean * 1000, 1),
+                    'deviation_ms': round(deviation * 1000, 1),
+                    'samples': samples,
+                }
+            return {'estimates': estimates, 'in_flight': dict(self._in_flight)}
@@ -0,0 +1,150 @@
+"""
+Server-side annotated previews
+
+Renders a downscaled copy of an already-decoded image with its boxes and
+labels drawn on, encoded as WebP or JPEG, and keeps the encoded bytes in a
+byte-bounded LRU cache keyed by image hash and render parameters.
+"""
+
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+# Same palette as the React ImageWithBoxes component
+COLORS = [
+    '#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8',
+    '#F7DC6F', '#BB8FCE', '#85C1E2', '#F8B739', '#52B788'
+]
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+def preview_key(image_hash, model, threshold, max_dim, fmt, options=None):
+    """
+    Cache key for one preview
+
+    Args:
+        image_hash: Content hash of the upload
+        model: Model whose detections are drawn
+        threshold: Confidence threshold of those detections
+        max_dim: Longest side of the preview in pixels
+        fmt: 'webp' or 'jpeg'
+        options: Per-request inference options (imgsz, rect, ...)
+
+    Returns:
+        Short hex key, safe to use in a URL
+    """
+    parts = [image_hash, model, f'{threshold:.4f}', str(max_dim), fmt]
+    parts.extend(f'{name}={value}' for name, value in sorted((options or {}).items()))
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def render_preview(image, detections, max_dim=512, fmt='webp', quality=80):
+    """
+    Draw detections on a downscaled copy of an image
+
+    Args:
+        image: Decoded PIL image (left untouched)
+        detections: List of {'class', 'confidence', 'box'} in the image's
+                    pixel space
+        max_dim: Longest side of the preview
+        fmt: 'webp' or 'jpeg'
+        quality: Encoder quality (1-100)
+
+    Returns:
+        Encoded image bytes
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"preview format must be one of: {', '.join(FORMATS)}")
+
+    preview = image.convert('RGB') if image.mode != 'RGB' else image.copy()
+    preview.thumbnail((max_dim, max_dim), Image.Resampling.BILINEAR)
+
+    scale_x = preview.width / image.width
+    scale_y = preview.height / image.height
+
+    draw = ImageDraw.Draw(preview)
+    font = ImageFont.load_default()
+    line_width = max(1, round(max(preview.size) / 256))
+
+    for index, detection in enumerate(detections):
+        x1, y1, x2, y2 = detection['box']
+        x1, x2 = x1 * scale_x, x2 * scale_x
+        y1, y2 = y1 * scale_y, y2 * scale_y
+        color = COLORS[index % len(COLORS)]
+
+        draw.rectangle([x1, y1, x2, y2], outline=color, width=line_width)
+
+        label = f"{detection['class']} {round(detection['confidence'] * 100)}%"
+        left, top, right, bottom = draw.textbbox((0, 0), label, font=font)
+        text_y = max(y1 - (bottom - top) - 4, 0)
+        draw.rectangle([x1, text_y, x1 + (right - left) + 6, text_y + (bottom - top) + 4], fill=color)
+        draw.text((x1 + 3, text_y + 2 - top), label, fill='#FFFFFF', font=font)
+
+    output = io.BytesIO()
+    preview.save(output, format=FORMATS[fmt][0], quality=quality)
+    return output.getvalue()
+
+
+class PreviewCache:
+    """
+    LRU cache of encoded previews, bounded by total bytes
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes: Evict least recently used previews above this size
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (bytes, mimetype) or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, data, mimetype):
+        """Store a preview, evicting old ones to stay under max_bytes"""
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+
+            self._entries[key] = (data, mimetype)
+            self.size += len(data)
+
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        """Entry count, bytes used and hit/miss counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
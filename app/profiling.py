@@ -0,0 +1,137 @@
+"""
+On-demand profiling for a running server
+
+- sample_stacks(): wall-clock sampling profiler over every Python thread,
+  returned as collapsed stacks (one "frame;frame;frame count" line per
+  stack, the input format of flamegraph.pl / speedscope)
+- torch_trace: records a torch.profiler trace of the next K model calls
+- stage(): cheap per-request stage timer used for slow-request logging
+
+Nothing here does any work unless a profile has been requested; the only
+cost on the hot path is an integer check per model call.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from app.config import PROFILE_DIR
+
+
+def sample_stacks(seconds, interval=0.005):
+    """
+    Sample the stacks of all other threads for a while
+
+    Args:
+        seconds: How long to sample
+        interval: Seconds between samples
+
+    Returns:
+        Counter of collapsed stack string -> number of samples
+    """
+    own_thread = threading.get_ident()
+    counts = Counter()
+
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+
+            stack.append(names.get(thread_id, str(thread_id)))
+            counts[';'.join(reversed(stack))] += 1
+
+        time.sleep(interval)
+
+    return counts
+
+
+def collapse_stacks(counts):
+    """Render sample_stacks() output as flamegraph-ready text"""
+    return '\n'.join(f"{stack} {count}" for stack, count in counts.most_common()) + '\n'
+
+
+class TorchTraceRecorder:
+    """
+    Records a torch.profiler trace for each of the next K model calls
+    """
+
+    def __init__(self, output_dir):
+        """
+        Args:
+            output_dir: Directory for the Chrome trace JSON files
+        """
+        self.output_dir = output_dir
+        self.remaining = 0
+        self.traces = []
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def arm(self, calls):
+        """Trace the next `calls` model calls"""
+        with self._lock:
+            self.remaining = calls
+            self.traces = []
+
+    def status(self):
+        """Remaining calls to trace and the traces written so far"""
+        return {'remaining': self.remaining, 'traces': list(self.traces)}
+
+    @contextmanager
+    def record(self):
+        """Wrap one model call; a no-op unless the recorder is armed"""
+        call_index = None
+        if self.remaining > 0:
+            with self._lock:
+                if self.remaining > 0:
+                    self.remaining -= 1
+                    call_index = self._count
+                    self._count += 1
+
+        if call_index is None:
+            yield
+            return
+
+        from torch.profiler import ProfilerActivity, profile
+
+        with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+            yield
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(
+            self.output_dir, f"torch_trace_{int(time.time())}_{call_index}.json"
+        )
+        prof.export_chrome_trace(path)
+        with self._lock:
+            self.traces.append(path)
+
+
+@contextmanager
+def stage(timings, name):
+    """
+    Time a block and store the duration (ms) in `timings[name]`
+
+    Args:
+        timings: Dictionary collecting the stage timings of one request
+        name: Stage name ('read', 'inference', ...)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = (time.perf_counter() - start) * 1000
+
+
+# Process-wide recorder used by YOLOClassifier
+torch_trace = TorchTraceRecorder(PROFILE_DIR)
@@ -0,0 +1,271 @@
+"""
+Model-affinity router for several API instances
+
+Keeps a health-checked list of backend instances (each one's
+/api/health reports which models it has loaded) and picks a backend for
+every request:
+
+1. only healthy backends serving the requested model are candidates
+2. candidates are ordered by a consistent-hash ring over the image
+   content hash, so repeat uploads land on the instance whose label
+   index / preview cache already has them
+3. if the preferred backend has noticeably more requests in flight than
+   the least busy candidate, the least busy one is used instead
+
+A backend that can't be reached is marked down and the next one is tried.
+One that accepted the request but doesn't answer in time is only slow:
+it stays up and the request isn't sent again (it may still be running
+there), the client gets a 504.
+"""
+
+import bisect
+import hashlib
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+class BackendTimeout(Exception):
+    """The backend took the request but did not answer within the timeout"""
+
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+        super().__init__(f'Backend {url} did not answer within {timeout:g}s')
+
+
+def ring_hash(value):
+    """64-bit position on the hash ring"""
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], 'big')
+
+
+class Backend:
+    """
+    One API instance behind the router
+    """
+
+    def __init__(self, url):
+        """
+        Args:
+            url: Base URL of the instance, e.g. http://127.0.0.1:5001
+        """
+        self.url = url.rstrip('/')
+        self.healthy = False
+        self.models = set()
+        self.outstanding = 0
+        self.last_check = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.outstanding += 1
+
+    def end(self):
+        with self._lock:
+            self.outstanding -= 1
+
+    def check_health(self, timeout=2.0):
+        """Refresh health and loaded models from /api/health"""
+        try:
+            with urllib.request.urlopen(f'{self.url}/api/health', timeout=timeout) as response:
+                health = json.loads(response.read())
+            self.models = set(health.get('available_models', []))
+            self.healthy = bool(health.get('models_loaded'))
+            self.last_error = None
+        except (OSError, ValueError) as e:
+            self.healthy = False
+            self.last_error = str(e)
+        self.last_check = time.time()
+
+    def status(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'models': sorted(self.models),
+            'outstanding': self.outstanding,
+            'last_check': self.last_check,
+            'last_error': self.last_error,
+        }
+
+
+class Router:
+    """
+    Picks a backend per request and forwards it
+    """
+
+    def __init__(self, urls, virtual_nodes=100, max_imbalance=4,
+                 health_interval=5.0, timeout=120.0):
+        """
+        Args:
+            urls: Backend base URLs
+            virtual_nodes: Ring positions per backend (smooths the spread)
+            max_imbalance: How many more in-flight requests the hashed
+                           backend may have than the least busy candidate
+            health_interval: Seconds between health checks
+            timeout: Seconds to wait for a backend response
+        """
+        self.backends = [Backend(url) for url in urls]
+        self.max_imbalance = max_imbalance
+        self.health_interval = health_interval
+        self.timeout = timeout
+
+        self._ring = sorted(
+            (ring_hash(f'{backend.url}#{i}'), index)
+            for index, backend in enumerate(self.backends)
+            for i in range(virtual_nodes)
+        )
+        self._positions = [position for position, _ in self._ring]
+        self._health_thread = None
+
+    def start_health_checks(self):
+        """Check every backend now, then periodically in the background"""
+        if self._health_thread is not None:
+            return
+        self.check_all()
+        self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self._health_thread.start()
+
+    def check_all(self):
+        for backend in self.backends:
+            backend.check_health()
+
+    def _health_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            self.check_all()
+
+    def candidates(self, models):
+        """Healthy backends that have every model in `models` loaded"""
+        return [
+            backend for backend in self.backends
+            if backend.healthy and set(models) <= backend.models
+        ]
+
+    def ring_order(self, key, candidates):
+        """Candidates in consistent-hash order for `key`"""
+        allowed = {id(backend) for backend in candidates}
+        ordered = []
+        start = bisect.bisect(self._positions, ring_hash(key))
+
+        for offset in range(len(self._ring)):
+            backend = self.backends[self._ring[(start + offset) % len(self._ring)][1]]
+            if id(backend) in allowed and backend not in ordered:
+                ordered.append(backend)
+                if len(ordered) == len(candidates):
+                    break
+        return ordered
+
+    def choose(self, key, models):
+        """
+        Backends to try for one request, best first
+
+        Args:
+            key: Content hash of the image (or any affinity key)
+            models: Models the request needs
+
+        Returns:
+            List of Backend (empty if nothing can serve the request)
+        """
+        candidates = self.candidates(models)
+        if not candidates:
+            return []
+
+        ordered = self.ring_order(key, candidates)
+        least_busy = min(candidates, key=lambda backend: backend.outstanding)
+        if ordered[0].outstanding - least_busy.outstanding > self.max_imbalance:
+            ordered.remove(least_busy)
+            ordered.insert(0, least_busy)
+        return ordered
+
+    def forward(self, backend, method, path, body=None, headers=None):
+        """
+        Send one request to a backend
+
+        Returns:
+            Tuple of (status code, response body, content type)
+
+        Raises:
+            OSError if the backend could not be reached
+            BackendTimeout if it was reached but did not answer in time
+        """
+        request = urllib.request.Request(
+            f'{backend.url}{path}', data=body, headers=headers or {}, method=method
+        )
+        backend.begin()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read(), response.headers.get('Content-Type')
+        except urllib.error.HTTPError as e:
+            # The backend answered; relay its error as-is
+            return e.code, e.read(), e.headers.get('Content-Type')
+        except socket.timeout:
+            # Connect timeouts arrive wrapped in URLError; a bare timeout
+            # means the connection was up and the request sent (or being
+            # sent)
+            raise BackendTimeout(backend.url, self.timeout)
+        finally:
+            backend.end()
+
+    def route(self, key, models, method, path, body=None, headers=None, retry_statuses=()):
+        """
+        Forward a request, failing over along the preference list
+
+        Args:
+            key: Affinity key (image content hash)
+            models: Models the request needs
+            method, path, body, headers: The request to forward
+            retry_statuses: Also try the next backend on these statuses
+                            (e.g. 404 for per-instance caches)
+
+        Returns:
+            Tuple of (status code, response body, content type, backend url),
+            or None if no backend could serve it. A backend that times out
+            after taking the request answers 504 and is not failed over.
+        """
+        result = None
+        for backend in self.choose(key, models):
+            try:
+                status, data, content_type = self.forward(backend, method, path, body, headers)
+            except BackendTimeout as e:
+                error = json.dumps({'success': False, 'error': str(e)}).encode()
+                return 504, error, 'application/json', backend.url
+            except OSError as e:
+                backend.healthy = False
+                backend.last_error = str(e)
+                continue
+
+            result = (status, data, content_type, backend.url)
+            if status not in retry_statuses:
+                break
+        return result
+
+    def broadcast(self, path, method='GET', body=None, headers=None, models=(), skip=()):
+        """
+        Send a request to every healthy backend
+
+        Args:
+            path, method, body, headers: The request to send
+            models: Only send to backends that have these models loaded
+            skip: Backend URLs to leave out (e.g. one already asked)
+
+        Returns:
+            List of (backend url, status code, response body); backends
+            that are down or time out are left out
+        """
+        responses = []
+        for backend in self.candidates(models):
+            if backend.url in skip:
+                continue
+            try:
+                status, data, _ = self.forward(backend, method, path, body, headers)
+                responses.append((backend.url, status, data))
+            except BackendTimeout:
+                continue  # Slow, not down
+            except OSError as e:
+                backend.healthy = False
+                backend.last_error = str(e)
+        return responses
@@ -0,0 +1,214 @@
+"""
+Bounded-memory handling of image uploads
+
+A 16MB upload can decode to a few hundred megabytes of pixels, so memory
+per request is bounded at each step:
+
+1. Spooling: SpooledRequest keeps small uploads in memory and streams
+   larger ones (above UPLOAD_SPOOL_BYTES) to a temporary file. The upload
+   is never copied into a bytes object; spilled files are memory-mapped,
+   so hashing and decoding read straight from the page cache.
+2. Header check: only the image header is parsed before anything is
+   decoded, and images over MAX_IMAGE_PIXELS / MAX_IMAGE_SIDE
+   (decompression bombs: a small file declaring huge dimensions) are
+   rejected.
+3. Pixel budget: decoding reserves width * height * bands bytes from a
+   process-wide PixelBudget and waits while other requests hold it, so
+   concurrent large images queue instead of exhausting memory. The
+   reservation is released when the request ends.
+"""
+
+import hashlib
+import io
+import mmap
+import tempfile
+import threading
+import time
+
+from flask import Request
+from PIL import Image
+
+
+class DecodeBudgetError(Exception):
+    """The decoded-pixel budget stayed exhausted for the whole wait"""
+
+    def __init__(self, needed, wait):
+        self.needed = needed
+        self.wait = wait
+        super().__init__(
+            f'Server is decoding too many images; {needed / 2**20:.0f} MB of pixel '
+            f'memory did not free up within {wait:g}s'
+        )
+
+
+class SpooledRequest(Request):
+    """
+    Request whose file uploads spill to disk above `spool_bytes`
+    """
+
+    spool_bytes = 1024 * 1024
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        # Chunked uploads have no length and go straight to disk
+        if total_content_length is not None and total_content_length <= self.spool_bytes:
+            return io.BytesIO()
+        return tempfile.TemporaryFile('rb+')
+
+
+class PixelBudget:
+    """
+    Counting semaphore over decoded pixel bytes
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes: Decoded bytes that may be held at once across requests
+        """
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self.waiting = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, needed, timeout):
+        """
+        Reserve `needed` bytes, waiting up to `timeout` seconds
+
+        Raises:
+            ValueError if `needed` exceeds the whole budget
+            DecodeBudgetError if the bytes did not free up in time
+        """
+        if needed > self.max_bytes:
+            raise ValueError(
+                f'Image needs {needed / 2**20:.0f} MB decoded; the limit is '
+                f'{self.max_bytes / 2**20:.0f} MB'
+            )
+
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self.waiting += 1
+            try:
+                while self.in_use + needed > self.max_bytes:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise DecodeBudgetError(needed, timeout)
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_use += needed
+            self.peak = max(self.peak, self.in_use)
+
+    def release(self, reserved):
+        """Return bytes reserved with acquire()"""
+        with self._condition:
+            self.in_use -= reserved
+            self._condition.notify_all()
+
+    def stats(self):
+        """Budget, bytes in use, peak and waiting requests"""
+        with self._condition:
+            return {
+                'max_bytes': self.max_bytes,
+                'in_use_bytes': self.in_use,
+                'peak_bytes': self.peak,
+                'waiting': self.waiting,
+            }
+
+
+class Upload:
+    """
+    An uploaded image: content hash and header now, pixels on demand
+    """
+
+    def __init__(self, stream, budget, max_pixels, max_side, wait=10.0):
+        """
+        Hash the upload and check its header (no pixels are decoded)
+
+        Args:
+            stream: Upload stream (BytesIO or file from SpooledRequest)
+            budget: PixelBudget charged by image()
+            max_pixels: Largest accepted width * height
+            max_side: Largest accepted width or height
+            wait: Seconds image() waits for the budget
+
+        Raises:
+            ValueError for empty, unreadable or oversized images
+        """
+        self.budget = budget
+        self.wait = wait
+        self.reserved = 0
+        self._image = None
+        self._header = None
+        self._stream = None
+
+        try:
+            self._open(stream, max_pixels, max_side)
+        except BaseException:
+            self.close()
+            raise
+
+    def _open(self, stream, max_pixels, max_side):
+        stream.seek(0)
+        if isinstance(stream, io.BytesIO):
+            self._stream = stream
+            with stream.getbuffer() as view:
+                self.num_bytes = len(view)
+                self.hash = hashlib.sha256(view).hexdigest()
+        else:
+            stream.seek(0, io.SEEK_END)
+            self.num_bytes = stream.tell()
+            if self.num_bytes:
+                self._stream = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+                self.hash = hashlib.sha256(self._stream).hexdigest()
+        if not self.num_bytes:
+            raise ValueError('Empty upload')
+
+        try:
+            self._header = Image.open(self._stream)  # Parses the header only
+        except Image.DecompressionBombError:
+            raise ValueError('Image dimensions are too large')
+        except OSError:
+            raise ValueError('Cannot read image')
+
+        self.size = self._header.size
+        width, height = self.size
+        if width > max_side or height > max_side:
+            raise ValueError(f'Image is {width}x{height}; the largest side allowed is {max_side}')
+        if width * height > max_pixels:
+            raise ValueError(
+                f'Image is {width * height / 1e6:.1f} MP; the limit is {max_pixels / 1e6:.1f} MP'
+            )
+
+        # Models see RGB, so palette / grayscale images are converted
+        self.decoded_bytes = width * height * max(len(self._header.getbands()), 3)
+
+    def image(self):
+        """
+        Decoded image, reserving its pixels from the budget on first call
+
+        Raises:
+            ValueError if the image is corrupt or over the whole budget
+            DecodeBudgetError if the budget stayed exhausted
+        """
+        if self._image is None:
+            self.budget.acquire(self.decoded_bytes, self.wait)
+            self.reserved = self.decoded_bytes
+            try:
+                self._header.load()
+            except (OSError, Image.DecompressionBombError):
+                raise ValueError('Cannot decode image')
+            self._image = self._header
+        return self._image
+
+    def close(self):
+        """Free the pixels, release the reservation and unmap the file"""
+        if self._header is not None:
+            self._header.close()
+        self._image = None
+        if self.reserved:
+            self.budget.release(self.reserved)
+            self.reserved = 0
+        if isinstance(self._stream, mmap.mmap):
+            self._stream.close()
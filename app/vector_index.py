@@ -0,0 +1,216 @@
+"""
+Memory-mapped nearest-neighbour index of image embeddings
+
+Append-only store of L2-normalised vectors (one per image content hash)
+with exact top-k cosine search. Everything lives in one directory:
+
+    vectors.f16   N x dim float16 rows (memory-mapped, grown by doubling)
+    ids.bin       N x 32-byte SHA-256 digests, row-aligned with vectors
+    meta.json     dim and the number of committed rows
+
+Rows are written before meta.json is replaced, so a crash never exposes a
+half-written row. Inserts are buffered and written in batches. Search
+scans the map in fixed-size chunks, so memory stays bounded and the OS
+page cache decides what stays resident: a million 576-d vectors take
+~1.1 GB on disk and one scan is a few hundred MFLOPs.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class VectorIndex:
+    """
+    Append-only float16 vector store with top-k cosine search
+    """
+
+    INITIAL_CAPACITY = 4096
+    FLUSH_SIZE = 256  # Buffered inserts written per batch
+    SEARCH_CHUNK = 16384  # Rows converted to float32 at a time
+
+    def __init__(self, directory, dim=None):
+        """
+        Open (or create) an index
+
+        Args:
+            directory: Directory holding the index files
+            dim: Vector dimension (must match an existing index; may be
+                 omitted when opening one)
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self._meta_path = os.path.join(directory, 'meta.json')
+        self._vectors_path = os.path.join(directory, 'vectors.f16')
+        self._ids_path = os.path.join(directory, 'ids.bin')
+
+        self.dim = dim
+        self.count = 0
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            if dim is not None and meta['dim'] != dim:
+                raise ValueError(f"Index in {directory} has dim {meta['dim']}, not {dim}")
+            self.dim = meta['dim']
+            self.count = meta['count']
+        elif dim is None:
+            raise ValueError(f"No index in {directory}; a dimension is needed to create one")
+
+        self._lock = threading.Lock()
+        self._pending = []  # (digest, vector) not yet written
+        self._open_maps(max(self.count, self.INITIAL_CAPACITY))
+
+        # Row of every stored image, to skip duplicates and look vectors up
+        self._rows = {bytes(digest): row for row, digest in enumerate(self._ids[:self.count])}
+
+    def _open_maps(self, capacity):
+        """(Re)map both files with room for `capacity` rows"""
+        for path, row_bytes in ((self._vectors_path, self.dim * 2), (self._ids_path, 32)):
+            with open(path, 'ab') as f:
+                if f.tell() < capacity * row_bytes:
+                    f.truncate(capacity * row_bytes)
+
+        self.capacity = capacity
+        self._vectors = np.memmap(
+            self._vectors_path, dtype=np.float16, mode='r+', shape=(capacity, self.dim)
+        )
+        self._ids = np.memmap(self._ids_path, dtype='V32', mode='r+', shape=(capacity,))
+
+    def __len__(self):
+        return self.count + len(self._pending)
+
+    def __contains__(self, image_hash):
+        digest = bytes.fromhex(image_hash)
+        with self._lock:
+            return digest in self._rows or any(d == digest for d, _ in self._pending)
+
+    def add(self, image_hash, vector):
+        """
+        Queue one vector (written once FLUSH_SIZE are pending)
+
+        Args:
+            image_hash: Hex content hash from hash_image()
+            vector: L2-normalised embedding of length dim
+        """
+        self.add_batch([image_hash], [vector])
+
+    def add_batch(self, image_hashes, vectors):
+        """Queue several vectors; images already in the index are skipped"""
+        with self._lock:
+            queued = {digest for digest, _ in self._pending}
+            for image_hash, vector in zip(image_hashes, vectors):
+                digest = bytes.fromhex(image_hash)
+                if digest in self._rows or digest in queued:
+                    continue
+                queued.add(digest)
+                self._pending.append((digest, np.asarray(vector, dtype=np.float32)))
+
+            if len(self._pending) >= self.FLUSH_SIZE:
+                self._flush()
+
+    def flush(self):
+        """Write all pending vectors"""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        needed = self.count + len(self._pending)
+        if needed > self.capacity:
+            capacity = self.capacity
+            while capacity < needed:
+                capacity *= 2
+            self._vectors.flush()
+            self._ids.flush()
+            del self._vectors, self._ids
+            self._open_maps(capacity)
+
+        start = self.count
+        digests = [digest for digest, _ in self._pending]
+        self._vectors[start:needed] = np.stack([vector for _, vector in self._pending])
+        self._ids[start:needed] = np.frombuffer(b''.join(digests), dtype='V32')
+        self._vectors.flush()
+        self._ids.flush()
+
+        # Commit the rows
+        for offset, digest in enumerate(digests):
+            self._rows[digest] = start + offset
+        self.count = needed
+        self._pending = []
+
+        tmp_path = self._meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'dim': self.dim, 'count': self.count}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def get(self, image_hash):
+        """Stored vector of an image (float32), or None"""
+        digest = bytes.fromhex(image_hash)
+        with self._lock:
+            for pending_digest, vector in self._pending:
+                if pending_digest == digest:
+                    return vector
+            row = self._rows.get(digest)
+            if row is None:
+                return None
+            return np.asarray(self._vectors[row], dtype=np.float32)
+
+    def search(self, vector, k=10, exclude=None):
+        """
+        Top-k most similar images by cosine similarity
+
+        Args:
+            vector: Query embedding (normalised here)
+            k: Number of results
+            exclude: Image hash to leave out (typically the query image)
+
+        Returns:
+            List of (image hash, similarity) pairs, most similar first
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        exclude = bytes.fromhex(exclude) if exclude else None
+
+        with self._lock:
+            self._flush()
+            count = self.count
+            vectors, ids = self._vectors, self._ids
+
+        # Rows below `count` are never rewritten, so the scan needs no lock
+        candidates, scores = [], []
+        for start in range(0, count, self.SEARCH_CHUNK):
+            chunk = vectors[start:min(start + self.SEARCH_CHUNK, count)]
+            similarity = chunk.astype(np.float32) @ query
+
+            top = min(k + 1, len(similarity))  # +1 in case the excluded row wins
+            best = np.argpartition(-similarity, top - 1)[:top]
+            candidates.extend(start + best)
+            scores.extend(similarity[best])
+
+        results = []
+        for index in np.argsort(-np.asarray(scores, dtype=np.float32)):
+            digest = bytes(ids[candidates[index]])
+            if digest == exclude:
+                continue
+            results.append((digest.hex(), float(scores[index])))
+            if len(results) == k:
+                break
+        return results
+
+    def stats(self):
+        """Number of vectors, dimension and on-disk size"""
+        with self._lock:
+            return {
+                'vectors': self.count + len(self._pending),
+                'dim': self.dim,
+                'bytes': self.capacity * (self.dim * 2 + 32),
+            }
+
+    def close(self):
+        """Write pending vectors"""
+        self.flush()
@@ -344,7 +344,8 @@ export default function BatchResultsDisplay({ batchResults, onReset }) {
                             <h4 className="font-semibold mb-2 text-primary-400">ObjectVision AI</h4>
                             <div className="w-full rounded-lg mb-2 overflow-hidden">
                               <ImageWithBoxes
-                                imageUrl={result.imageUrl}
+                                imageUrl={(result.annotated && result.results.results?.medium?.preview_url) || result.imageUrl}
+                                annotated={result.annotated}
                                 detections={result.results.results?.medium?.detections}
                                 width={result.results.results?.medium?.width}
                                 height={result.results.results?.medium?.height}
@@ -367,7 +368,8 @@ export default function BatchResultsDisplay({ batchResults, onReset }) {
                             <h4 className="font-semibold mb-2 text-purple-400">ObjectVision AI+</h4>
                             <div className="w-full rounded-lg mb-2 overflow-hidden">
                               <ImageWithBoxes
-                                imageUrl={result.imageUrl}
+                                imageUrl={(result.annotated && result.results.results?.large?.preview_url) || result.imageUrl}
+                                annotated={result.annotated}
                                 detections={result.results.results?.large?.detections}
                                 width={result.results.results?.large?.width}
                                 height={result.results.results?.large?.height}
@@ -391,6 +393,7 @@ export default function BatchResultsDisplay({ batchResults, onReset }) {
                           <div className="overflow-hidden rounded-lg">
                             <ImageWithBoxes
                               imageUrl={result.imageUrl}
+                              annotated={result.annotated}
                               detections={result.results?.detections}
                               width={result.results?.width}
                               height={result.results?.height}
@@ -1,11 +1,12 @@
 import { useEffect, useRef } from 'react'
 
-export default function ImageWithBoxes({ imageUrl, detections, width, height }) {
+export default function ImageWithBoxes({ imageUrl, detections, width, height, annotated = false }) {
   const canvasRef = useRef(null)
   const imageRef = useRef(null)
 
   useEffect(() => {
-    if (!imageRef.current || !canvasRef.current || !detections || detections.length === 0) {
+    // Server-rendered previews already have the boxes drawn in
+    if (annotated || !imageRef.current || !canvasRef.current || !detections || detections.length === 0) {
       return
     }
 
@@ -77,7 +78,7 @@ export default function ImageWithBoxes({ imageUrl, detections, width, height })
       img.addEventListener('load', drawBoxes)
       return () => img.removeEventListener('load', drawBoxes)
     }
-  }, [imageUrl, detections, width, height])
+  }, [imageUrl, detections, width, height, annotated])
 
   return (
     <div className="relative inline-block">
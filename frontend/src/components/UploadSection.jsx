@@ -97,6 +97,9 @@ export default function UploadSection({ onAnalysis, onBatchAnalysis, loading, se
 
     const results = []
     const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:5000'
+    // Lets the server answer near-duplicates within the batch without
+    // running the model again
+    const batchId = crypto.randomUUID()
 
     for (let i = 0; i < selectedFiles.length; i++) {
       const file = selectedFiles[i]
@@ -106,6 +109,11 @@ export default function UploadSection({ onAnalysis, onBatchAnalysis, loading, se
         const formData = new FormData()
         formData.append('image', file)
         formData.append('model', selectedModel)
+        formData.append('batch_id', batchId)
+        // Ask the server for a small annotated preview instead of keeping
+        // a full-size data URL per image in memory
+        formData.append('preview', 'true')
+        formData.append('preview_size', '640')
 
         const response = await axios.post(`${apiUrl}/api/predict_with_boxes`, formData, {
           headers: {
@@ -113,16 +121,28 @@ export default function UploadSection({ onAnalysis, onBatchAnalysis, loading, se
           }
         })
 
-        // Get image preview
-        const imageUrl = await new Promise((resolve) => {
-          const reader = new FileReader()
-          reader.onloadend = () => resolve(reader.result)
-          reader.readAsDataURL(file)
+        const data = response.data
+        const modelResults = data.mode === 'comparison' ? Object.values(data.results) : [data]
+        modelResults.forEach((modelResult) => {
+          if (modelResult.preview_url) {
+            modelResult.preview_url = `${apiUrl}${modelResult.preview_url}`
+          }
         })
+        const annotated = modelResults.every((modelResult) => modelResult.preview_url)
+
+        // Get image preview (server-rendered when available)
+        const imageUrl = annotated
+          ? modelResults[0].preview_url
+          : await new Promise((resolve) => {
+            const reader = new FileReader()
+            reader.onloadend = () => resolve(reader.result)
+            reader.readAsDataURL(file)
+          })
 
         results.push({
           filename: file.name,
           imageUrl,
+          annotated,
           results: response.data,
           success: true
         })
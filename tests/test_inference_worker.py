@@ -0,0 +1,89 @@
+"""
+Inference worker: shared-memory rings are unmapped when a client goes away
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.inference_worker import InferenceServer, WorkerClient
+
+AUTHKEY = b'test-key'
+
+
+class FakeClassifier:
+    """Stands in for YOLOClassifier; holds on to its last batch like ultralytics"""
+
+    model_size = 'n'
+    class_names = {0: 'person'}
+    threshold = 0.5
+
+    def __init__(self):
+        self.last_batch = None
+
+    def get_model_info(self):
+        return {}
+
+    def detect_batch(self, images, **options):
+        self.last_batch = images
+        return [
+            {'detections': [], 'width': image.shape[1], 'height': image.shape[0],
+             'input_size': [640, 640], 'inference_time': 0.0}
+            for image in images
+        ]
+
+    def release_inputs(self):
+        self.last_batch = None
+
+
+class RecordingServer(InferenceServer):
+    """Keeps the rings it detaches so the test can inspect them"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.detached = []
+
+    def _detach(self, ring, timeout=10.0):
+        super()._detach(ring, timeout)
+        self.detached.append(ring)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_ring_unmapped_after_client_disconnects():
+    address = ('127.0.0.1', free_port())
+    server = RecordingServer({'medium': FakeClassifier()}, batch_wait_ms=1)
+    threading.Thread(
+        target=server.serve_forever, args=(address, AUTHKEY), daemon=True
+    ).start()
+
+    client = WorkerClient(address, authkey=AUTHKEY, num_slots=2,
+                          slot_bytes=64 * 64 * 3, connect_timeout=5)
+    image = np.zeros((32, 48, 3), dtype=np.uint8)
+    result = client.submit('medium', image, 0.5).result(timeout=5)
+    assert result['width'] == 48
+
+    client.close()
+
+    assert wait_for(lambda: server.detached), 'ring was not detached'
+    assert server.detached[0].shm.buf is None  # Unmapped
+    assert all(not jobs for jobs in server._jobs.values())